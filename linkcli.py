@@ -0,0 +1,119 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+
+from linkcore import job_manager, worker_thread, bulk_worker_thread
+
+# ==========================================
+# 命令行批量转存 (不依赖 Streamlit)
+# 用法:
+#   python linkcli.py -i posts.txt -o posts_new.txt --user vip001
+#   cat posts.txt | python linkcli.py --quark-cookie "..." --concurrency 3 > out.txt 2> progress.jsonl
+#   python linkcli.py --stream -i archive.jsonl -o archive_new.jsonl --user vip001   (大文件逐条处理)
+# 进度以 JSON Lines 写到 stderr，转换后的文本写到 -o 或 stdout
+# 引擎的调试输出默认丢弃 (--debug 时写到 stderr)，不会混进 stdout 的结果
+# Ctrl+C 取消任务：进行中的链接在阶段边界停止，已转换的部分照常输出
+# ==========================================
+def load_account(secrets_path, uid):
+    """从 Streamlit 的 secrets.toml 读取 [users.<uid>] 配置，字段与网页版一致"""
+    try:
+        import tomllib
+    except ImportError:
+        sys.exit("读取 secrets.toml 需要 Python 3.11+，或直接使用 --quark-cookie / --baidu-cookie")
+    try:
+        with open(secrets_path, "rb") as f:
+            users = tomllib.load(f).get("users", {})
+    except OSError as e:
+        sys.exit(f"无法读取 {secrets_path}: {e}")
+    if uid not in users:
+        sys.exit(f"{secrets_path} 中没有用户 {uid}")
+    return dict(users[uid])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="网盘转存助手 - 命令行批量模式")
+    parser.add_argument("-i", "--input", help="输入文本文件 (默认读取 stdin)")
+    parser.add_argument("-o", "--output", help="输出文件 (默认写到 stdout)")
+    parser.add_argument("--user", help="使用 secrets.toml 中 [users.<uid>] 的 Cookie 与广告配置")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"), help="secrets.toml 路径")
+    parser.add_argument("--quark-cookie", default=os.environ.get("LINKCHANGER_QUARK_COOKIE", ""))
+    parser.add_argument("--baidu-cookie", default=os.environ.get("LINKCHANGER_BAIDU_COOKIE", ""))
+    parser.add_argument("--quark-img", default="", help="夸克广告链接")
+    parser.add_argument("--baidu-img", default="", help="百度广告链接")
+    parser.add_argument("--baidu-img-pwd", default="", help="百度广告提取码")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="每个账号同时处理的链接数 (默认：夸克按流水线容量，百度 1)")
+    parser.add_argument("--stream", action="store_true", help="按记录流式处理 -i 文件并逐条写入 -o (txt/csv/jsonl)")
+    parser.add_argument("--debug", action="store_true", help="把引擎调试输出写到 stderr (会与进度 JSON 混在一起)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    conf = load_account(args.secrets, args.user) if args.user else {}
+    quark_cookie = args.quark_cookie or conf.get("q", "")
+    baidu_cookie = args.baidu_cookie or conf.get("b", "")
+    if not quark_cookie and not baidu_cookie:
+        sys.exit("请提供 Cookie：--user / --quark-cookie / --baidu-cookie 或环境变量")
+
+    q_img = args.quark_img or conf.get("q_img", "")
+    b_img = args.baidu_img or conf.get("b_img", "")
+    image_config = {
+        "quark": {"url": q_img, "enabled": bool(q_img)},
+        "baidu": {"url": b_img, "pwd": args.baidu_img_pwd or conf.get("b_pwd", ""), "enabled": bool(b_img)}
+    }
+
+    if args.stream and not (args.input and args.output):
+        sys.exit("--stream 需要同时指定 -i 与 -o")
+
+    def print_event(job_id, event, data):
+        sys.stderr.write(json.dumps({"job_id": job_id, "event": event, **data}, ensure_ascii=False, default=str) + "\n")
+        sys.stderr.flush()
+
+    job_id = job_manager.create_job(bulk=args.stream)
+    # 命令行模式不发推送：进程结束时后台发件线程来不及送达
+    if args.stream:
+        target, target_args = bulk_worker_thread, (job_id, args.input, args.output, quark_cookie, baidu_cookie, "", "",
+                                                   image_config, args.user or "cli")
+    else:
+        if args.input:
+            with open(args.input, encoding="utf-8") as f:
+                input_text = f.read()
+        else:
+            input_text = sys.stdin.read()
+        target, target_args = worker_thread, (job_id, input_text, quark_cookie, baidu_cookie, "", "", image_config,
+                                              args.user or "cli", args.concurrency)
+
+    job_manager.subscribe(print_event)
+    # 引擎用 print 输出调试信息：任务期间把 stdout 转走，stdout 只留给转换结果
+    debug_out = sys.stderr if args.debug else open(os.devnull, "w", encoding="utf-8")
+    try:
+        with contextlib.redirect_stdout(debug_out):
+            # 任务在子线程中运行，主线程保留给 Ctrl+C
+            worker = threading.Thread(target=target, args=target_args)
+            worker.start()
+            while worker.is_alive():
+                try:
+                    worker.join(0.5)
+                except KeyboardInterrupt:
+                    job_manager.cancel_job(job_id)
+    finally:
+        job_manager.unsubscribe(print_event)
+        if debug_out is not sys.stderr: debug_out.close()
+
+    job = job_manager.get_job(job_id)
+    if args.stream:
+        pass  # 结果已由 bulk_worker_thread 逐条写入 -o
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(job["result_text"])
+    else:
+        sys.stdout.write(job["result_text"])
+        sys.stdout.flush()
+
+    summary = job["summary"]
+    return 1 if summary.get("total") and not summary.get("success") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2359 @@
+import httpx
+import requests
+import asyncio
+import re
+import time
+import random
+import string
+import json
+import csv
+import io
+import threading
+import uuid
+import os
+import html
+import bisect
+import contextvars
+import hashlib
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote
+from datetime import datetime, timedelta, timezone
+from typing import Union, List, Any, Callable, Iterable, Iterator, NamedTuple
+from retrying import retry
+
+# ==========================================
+# 0. 全局对象
+# ==========================================
+# 全局任务管理器 (多用户共用一个管理器是安全的，只要 job_id 不冲突)
+class JobManager:
+    def __init__(self):
+        self.jobs = {} 
+        self.listeners = []  # callback(job_id, event, data)，供 CLI / API 实时获取进度
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners: self.listeners.remove(callback)
+
+    def _emit(self, job_id, event, **data):
+        for callback in list(self.listeners):
+            try: callback(job_id, event, data)
+            except: pass
+
+    def _cleanup_old_jobs(self):
+        now = datetime.now()
+        expired_ids = [jid for jid, job in self.jobs.items() 
+                       if (now - job['created_at']).total_seconds() > 86400]
+        for jid in expired_ids:
+            for path in self.jobs[jid].get("files", []):
+                try: os.remove(path)
+                except OSError: pass
+            del self.jobs[jid]
+
+    def create_job(self, bulk=False, owner=""):
+        """
+        bulk=True：大文件任务，不记录时间线，日志只保留最近 BULK_LOG_KEEP 条。
+        owner：提交任务的用户 uid，本地 API 只向该用户返回任务数据或受理取消
+        """
+        self._cleanup_old_jobs()
+        job_id = str(uuid.uuid4())[:8]
+        self.jobs[job_id] = {
+            "status": "running",
+            "logs": [],
+            "log_base": 0,         # 已丢弃的日志条数
+            "log_limit": BULK_LOG_KEEP if bulk else 0,
+            "result_text": "",
+            "result_file": None,
+            "files": [],           # 任务过期时一并删除的文件
+            "progress": {"current": 0, "total": 0},
+            "created_at": datetime.now(),
+            "started_ts": time.time(),
+            "timeline": None if bulk else [],
+            "bulk": bulk,
+            "owner": owner,
+            "cancel_requested": False,
+            "summary": {}
+        }
+        return job_id
+
+    def cancel_job(self, job_id):
+        """请求取消运行中的任务：后台线程在下一个阶段边界停止，已完成的链接照常保留。返回是否受理"""
+        job = self.jobs.get(job_id)
+        if not job or job["status"] != "running" or job["cancel_requested"]: return False
+        job["cancel_requested"] = True
+        self.add_log(job_id, "⏹ 已请求取消，正在停止...", "error")
+        return True
+
+    def is_cancelled(self, job_id):
+        job = self.jobs.get(job_id)
+        return bool(job and job["cancel_requested"])
+
+    def attach_files(self, job_id, *paths):
+        if job_id in self.jobs:
+            self.jobs[job_id]["files"].extend(paths)
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def add_log(self, job_id, message, type="info"):
+        if job_id in self.jobs:
+            timestamp = (datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%H:%M:%S")
+            safe_message = html.escape(message)
+            job = self.jobs[job_id]
+            job["logs"].append({"time": timestamp, "msg": safe_message, "type": type})
+            if job["log_limit"] and len(job["logs"]) > job["log_limit"]:
+                drop = len(job["logs"]) - job["log_limit"]
+                del job["logs"][:drop]
+                job["log_base"] += drop
+            self._emit(job_id, "log", time=timestamp, msg=message, type=type)
+
+    def update_progress(self, job_id, current, total):
+        if job_id in self.jobs:
+            self.jobs[job_id]["progress"] = {"current": current, "total": total}
+            self._emit(job_id, "progress", current=current, total=total)
+
+    def add_span(self, job_id, link, label, provider, stage, kind, start, end, outcome="ok"):
+        """kind: network, wait (任务轮询), sleep (节流等待), link (单链接总耗时)"""
+        if job_id in self.jobs and self.jobs[job_id]["timeline"] is not None:
+            base = self.jobs[job_id]["started_ts"]
+            self.jobs[job_id]["timeline"].append({
+                "link": link, "label": label, "provider": provider, "stage": stage, "kind": kind,
+                "start": start - base, "end": end - base, "outcome": outcome
+            })
+
+    def complete_job(self, job_id, final_text, summary, result_file=None):
+        """结束任务：status 为 done，已请求取消的任务为 cancelled"""
+        if job_id in self.jobs:
+            self.jobs[job_id]["status"] = "cancelled" if self.jobs[job_id]["cancel_requested"] else "done"
+            self.jobs[job_id]["result_text"] = final_text
+            self.jobs[job_id]["result_file"] = result_file
+            self.jobs[job_id]["summary"] = summary
+            self._emit(job_id, "done", **summary)
+
+job_manager = JobManager()
+
+# ==========================================
+# 1. 链接识别规则
+# ==========================================
+INVALID_CHARS_REGEX = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9_\-\s]')
+
+# 单次扫描识别所有支持的分享链接 (新增网盘只需在此追加命名分组)
+SHARE_LINK_REGEX = re.compile(
+    r'(?P<quark>https://pan\.quark\.cn/s/[a-zA-Z0-9]+(?:\?pwd=[a-zA-Z0-9]+)?)'
+    r'|(?P<baidu>https?://pan\.baidu\.com/s/[a-zA-Z0-9_\-]+(?:\?pwd=[a-zA-Z0-9]+)?)'
+)
+URL_PWD_REGEX = re.compile(r'[?&]pwd=([a-zA-Z0-9]+)')
+NEARBY_PASSCODE_REGEX = re.compile(r'(?:提取码|访问码|密码|pwd|code)\s*[:：=]?\s*([a-zA-Z0-9]{4})(?![a-zA-Z0-9])', re.IGNORECASE)
+PASSCODE_WINDOW = 40     # 链接之后查找提取码的最大字符数
+STREAM_KEEP_CHARS = 512  # 流式扫描时为跨块链接保留的尾部长度
+
+# 与 str.splitlines() 相同的换行集合
+LINE_BREAK_REGEX = re.compile(r'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+TITLE_SKIP_REGEX = re.compile(r'^(百度|链接|提取码|:|：|https?|夸克|pwd|code)*$', re.IGNORECASE)
+TITLE_TRIM_REGEX = re.compile(r'(百度|链接|提取码|:|：|pwd|夸克).*$', re.IGNORECASE)
+FOLDER_NAME_LOOKBACK = 200
+
+# ==========================================
+# 2. 辅助函数
+# ==========================================
+class ShareLink(NamedTuple):
+    provider: str  # quark / baidu
+    url: str       # 文本中出现的原始链接 (用于替换)
+    pwd: str       # 链接自带或紧随其后的提取码
+    start: int     # 在输入文本中的绝对偏移
+    end: int
+
+def _make_share_link(match, text, base, window_end):
+    url = match.group(0)
+    pwd_match = URL_PWD_REGEX.search(url)
+    if pwd_match:
+        pwd = pwd_match.group(1)
+    else:
+        nearby = NEARBY_PASSCODE_REGEX.search(text, match.end(), window_end)
+        pwd = nearby.group(1) if nearby else ""
+    return ShareLink(match.lastgroup, url, pwd, base + match.start(), base + match.end())
+
+def iter_share_links(chunks: Iterable[str]) -> Iterator[ShareLink]:
+    """
+    对文本块流做单次线性扫描，按出现顺序产出 ShareLink。
+    每个链接的提取码只在其后 PASSCODE_WINDOW 个字符内 (且不越过下一个链接) 查找。
+    """
+    buffer, base = "", 0
+    chunk_iter = iter(chunks)
+    exhausted = False
+    while not exhausted:
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer += chunk
+
+        matches = list(SHARE_LINK_REGEX.finditer(buffer))
+        emitted_end = 0
+        pending_start = None
+        for i, match in enumerate(matches):
+            # 链接或其提取码窗口可能延伸到下一块：等更多数据
+            if not exhausted and match.end() + PASSCODE_WINDOW >= len(buffer):
+                pending_start = match.start()
+                break
+            window_end = min(match.end() + PASSCODE_WINDOW, len(buffer))
+            if i + 1 < len(matches):
+                window_end = min(window_end, matches[i + 1].start())
+            yield _make_share_link(match, buffer, base, window_end)
+            emitted_end = match.end()
+
+        if exhausted: break
+        cut = max(emitted_end, len(buffer) - STREAM_KEEP_CHARS)
+        if pending_start is not None:
+            cut = min(cut, pending_start)
+        buffer = buffer[cut:]
+        base += cut
+
+def scan_share_links(text: str) -> List[ShareLink]:
+    return list(iter_share_links((text,)))
+
+def plan_folder_names(names, job_tag, seen=None):
+    """
+    为一个任务的全部链接预先确定文件夹名：统一追加任务标签避免与历史任务冲突，
+    同一任务内重名则在本地追加序号，不再依赖随机后缀。
+    分批规划时传入同一个 seen 字典，跨批次继续计数。
+    """
+    seen = {} if seen is None else seen
+    planned = []
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        planned.append(f"{name}_{job_tag}" if seen[name] == 1 else f"{name}_{job_tag}_{seen[name]}")
+    return planned
+
+def get_time_diff(start_time):
+    diff = time.time() - start_time
+    return f"{diff:.2f}s"
+
+def smart_shorten_url(text):
+    url_pattern = re.compile(r'(https?://[^\s]+)')
+    def replace_func(match):
+        url = match.group(1)
+        try:
+            domain = url.split('/')[2]
+            if "quark" in domain: domain = "夸克"
+            elif "baidu" in domain: domain = "百度"
+            suffix = url[-8:] if len(url) > 20 else url[-5:]
+            short_text = f"{domain}...{suffix}"
+            return f'<span class="smart-link" title="{url}">{short_text}</span>'
+        except:
+            return f'<span class="smart-link" title="{url}">链接...</span>'
+    return url_pattern.sub(replace_func, text)
+
+def compute_critical_path(spans):
+    """
+    从任务结束时刻倒推：每一步选择在游标前最晚结束的阶段 (同时结束取先记录的)，得到决定总耗时的阶段链。
+    阶段按结束时刻排序一次，每一步用 bisect 定位，已选过的位置用并查集跳过，总体 O(n log n)。
+    """
+    order = sorted((i for i, sp in enumerate(spans) if sp['kind'] != 'link'), key=lambda i: (spans[i]['end'], -i))
+    if not order: return set()
+    ends = [spans[i]['end'] for i in order]
+    below = list(range(len(order)))  # below[k]：不大于 k 的最大未选位置，-1 表示没有
+
+    def unused_at_or_below(k):
+        root = k
+        while root >= 0 and below[root] != root: root = below[root]
+        while k >= 0 and below[k] != k: below[k], k = root, below[k]
+        return root
+
+    cursor = ends[-1]
+    path = set()
+    while True:
+        k = unused_at_or_below(bisect.bisect_right(ends, cursor + 1e-3) - 1)
+        if k < 0: break
+        path.add(order[k])
+        below[k] = k - 1
+        cursor = spans[order[k]]['start']
+    return path
+
+def summarize_timeline(spans):
+    totals = {"network": 0.0, "wait": 0.0, "sleep": 0.0}
+    link_durations = {}
+    for sp in spans:
+        if sp['kind'] == 'link':
+            link_durations[(sp['link'], sp['label'])] = sp['end'] - sp['start']
+        elif sp['kind'] in totals:
+            totals[sp['kind']] += sp['end'] - sp['start']
+    slowest = sorted(link_durations.items(), key=lambda kv: kv[1], reverse=True)[:3]
+    return totals, slowest
+
+def format_size(num_bytes):
+    size = float(num_bytes or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024: return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+def sanitize_filename(name: str) -> str:
+    if not name: return ""
+    name = re.sub(r'[【】\[\]()]', ' ', name)
+    clean_name = INVALID_CHARS_REGEX.sub('', name)
+    return re.sub(r'\s+', ' ', clean_name).strip()
+
+def _title_candidate(line: str) -> str:
+    clean_line = line.strip()
+    if not clean_line or TITLE_SKIP_REGEX.match(clean_line):
+        return ""
+    return TITLE_TRIM_REGEX.sub('', clean_line).strip()
+
+class FolderNameIndex:
+    """
+    对整段输入建立一次行偏移索引，按链接偏移二分定位所在行，
+    完整行的"标题候选"结果缓存复用，所有链接的文件夹名推导总体为线性。
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self.line_starts = [0]
+        self.line_ends = []
+        for m in LINE_BREAK_REGEX.finditer(text):
+            self.line_ends.append(m.start())
+            self.line_starts.append(m.end())
+        self.line_ends.append(len(text))
+        self._candidates = {}
+
+    def _line_candidate(self, line_no: int) -> str:
+        if line_no not in self._candidates:
+            self._candidates[line_no] = _title_candidate(self.text[self.line_starts[line_no]:self.line_ends[line_no]])
+        return self._candidates[line_no]
+
+    def name_at(self, match_start: int) -> str:
+        lookback_limit = max(0, match_start - FOLDER_NAME_LOOKBACK)
+        line_no = bisect.bisect_right(self.line_starts, match_start) - 1
+        candidate_name = ""
+        while line_no >= 0:
+            start = self.line_starts[line_no]
+            end = min(self.line_ends[line_no], match_start)
+            if end <= lookback_limit: break
+            if start >= lookback_limit and end == self.line_ends[line_no]:
+                candidate_name = self._line_candidate(line_no)
+            else:
+                # 链接所在行的前半段 / 回看窗口切开的首行，不缓存
+                candidate_name = _title_candidate(self.text[max(start, lookback_limit):end])
+            if candidate_name: break
+            line_no -= 1
+        final_name = sanitize_filename(candidate_name)
+        if not final_name or len(final_name) < 2:
+            return f"Res_{int(time.time())}" 
+        return final_name[:50]
+
+def extract_smart_folder_name(full_text: str, match_start: int) -> str:
+    """单次调用的便捷入口；批量处理请复用同一个 FolderNameIndex"""
+    return FolderNameIndex(full_text).name_at(match_start)
+
+def send_notification(bark_key, pushdeer_key, title, body, uid=""):
+    """投递到通知发件箱后立即返回，实际发送由 NotificationDispatcher 后台完成"""
+    notifier.enqueue(bark_key, pushdeer_key, title, body, uid)
+
+class TTLCache:
+    """线程安全的过期字典 (跨任务共享)，超出 max_entries 时按写入顺序淘汰"""
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (value, expires_at)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry: return None
+            if entry[1] <= time.time():
+                del self.entries[key]
+                return None
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+
+    def drop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+# ==========================================
+# 2.1 阶段耗时指标 (Prometheus)
+# ==========================================
+METRIC_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class MetricsRegistry:
+    """按 provider/account/stage 聚合的耗时直方图与计数器"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (provider, account, stage) -> {"buckets", "sum", "count"}
+        self.counters = {}    # (provider, account, stage, outcome) -> int
+
+    def observe(self, provider, account, stage, seconds, outcome="ok"):
+        key = (provider, account or "default", stage)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"buckets": [0] * len(METRIC_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(METRIC_BUCKETS):
+                if seconds <= bound: hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+            counter_key = key + (outcome,)
+            self.counters[counter_key] = self.counters.get(counter_key, 0) + 1
+
+    def render_prometheus(self):
+        def labels(**kv):
+            esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kv.items()) + "}"
+
+        with self.lock:
+            histograms = {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]} for k, v in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = [
+            "# HELP linkchanger_stage_seconds 转存流水线各阶段耗时",
+            "# TYPE linkchanger_stage_seconds histogram",
+        ]
+        for (provider, account, stage), hist in sorted(histograms.items()):
+            base = {"provider": provider, "account": account, "stage": stage}
+            for bound, count in zip(METRIC_BUCKETS, hist["buckets"]):
+                lines.append(f"linkchanger_stage_seconds_bucket{labels(**base, le=bound)} {count}")
+            lines.append(f"linkchanger_stage_seconds_bucket{labels(**base, le='+Inf')} {hist['count']}")
+            lines.append(f"linkchanger_stage_seconds_sum{labels(**base)} {hist['sum']:.6f}")
+            lines.append(f"linkchanger_stage_seconds_count{labels(**base)} {hist['count']}")
+
+        lines.append("# HELP linkchanger_stage_total 各阶段执行次数 (按结果)")
+        lines.append("# TYPE linkchanger_stage_total counter")
+        for (provider, account, stage, outcome), count in sorted(counters.items()):
+            lines.append(f"linkchanger_stage_total{labels(provider=provider, account=account, stage=stage, outcome=outcome)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+# 当前执行上下文所属的任务/链接，供 stage_span 写入任务时间线
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def trace_link(job_id, link=None, label=""):
+    """标记后续阶段归属的链接；link 为 None 表示任务级阶段 (登录、定位目录等)"""
+    current_trace.set({"job_id": job_id, "link": link, "label": label})
+
+def trace_cancelled():
+    """当前链接所属任务是否已请求取消 (供不持有 job_id 的流水线在阶段边界检查)"""
+    trace = current_trace.get()
+    return bool(trace) and job_manager.is_cancelled(trace["job_id"])
+
+class Span:
+    def __init__(self):
+        self.outcome = "ok"
+
+    def fail(self, outcome="error"):
+        self.outcome = outcome
+
+@contextmanager
+def stage_span(provider, account, stage, kind="network"):
+    """记录一个阶段的耗时；业务失败时调用 span.fail()，抛出异常时自动记为 error"""
+    span = Span()
+    t0 = time.perf_counter()
+    wall_start = time.time()
+    try:
+        yield span
+    except BaseException:
+        span.fail()
+        raise
+    finally:
+        metrics.observe(provider, account, stage, time.perf_counter() - t0, span.outcome)
+        trace = current_trace.get()
+        if trace:
+            job_manager.add_span(trace["job_id"], trace["link"], trace["label"], provider, stage, kind,
+                                 wall_start, time.time(), span.outcome)
+
+
+# ==========================================
+# 2.2 多账号调度
+# ==========================================
+# 账号级错误：命中后该账号进入冷却，链接交给同网盘的其他账号
+ACCOUNT_QUOTA_MARKERS = ("容量不足", "文件数超出限制", "空间不足", "Cookie身份失效", "capacity")
+ACCOUNT_THROTTLE_MARKERS = ("验证码", "频繁", "captcha", "too many")
+
+def split_cookies(value):
+    """users.q / users.b 既可以是单个 Cookie，也可以是列表或按行分隔的多个 Cookie"""
+    if not value: return []
+    items = value if isinstance(value, (list, tuple)) else str(value).splitlines()
+    return [c.strip() for c in items if c and str(c).strip()]
+
+def cookie_key(cookie):
+    return hashlib.sha1(cookie.encode("utf-8")).hexdigest()[:16]
+
+def account_labels(account, cookies):
+    """单账号沿用 uid，多账号为 uid#1、uid#2 ... (用于指标与日志)"""
+    if len(cookies) <= 1: return {c: account for c in cookies}
+    return {c: f"{account}#{i}" for i, c in enumerate(cookies, 1)}
+
+def classify_account_error(msg):
+    """返回 quota / throttle / None"""
+    if not msg: return None
+    lowered = msg.lower()
+    if any(m in lowered for m in ACCOUNT_QUOTA_MARKERS): return "quota"
+    if any(m in lowered for m in ACCOUNT_THROTTLE_MARKERS): return "throttle"
+    return None
+
+class AccountScheduler:
+    """
+    同一网盘多个账号之间的负载调度 (跨任务共享)：
+    优先选在途链接最少、累计处理最少的账号；容量/验证码受限的账号冷却一段时间。
+    全部账号都在冷却时仍按负载返回，保持单账号时的原有行为 (由网盘返回真实错误)。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}  # (provider, cookie_key) -> {"inflight", "done", "cooldown_until", "reason"}
+
+    def _entry(self, provider, cookie):
+        key = (provider, cookie_key(cookie))
+        entry = self.state.get(key)
+        if entry is None:
+            entry = self.state[key] = {"inflight": 0, "done": 0, "cooldown_until": 0, "reason": ""}
+        return entry
+
+    def _rank(self, provider, cookies, exclude):
+        now = time.time()
+        candidates = [c for c in cookies if c not in exclude]
+        ready = [c for c in candidates if self._entry(provider, c)["cooldown_until"] <= now]
+        return sorted(ready or candidates, key=lambda c: (self._entry(provider, c)["inflight"], self._entry(provider, c)["done"]))
+
+    def rank(self, provider, cookies, exclude=()):
+        with self.lock:
+            return self._rank(provider, cookies, exclude)
+
+    def pick(self, provider, cookies, exclude=()):
+        """选出负载最低的账号并计入在途；没有可选账号返回 None"""
+        with self.lock:
+            ranked = self._rank(provider, cookies, exclude)
+            if not ranked: return None
+            self._entry(provider, ranked[0])["inflight"] += 1
+            return ranked[0]
+
+    def acquire(self, provider, cookie):
+        with self.lock:
+            self._entry(provider, cookie)["inflight"] += 1
+
+    def release(self, provider, cookie):
+        with self.lock:
+            entry = self._entry(provider, cookie)
+            entry["inflight"] = max(0, entry["inflight"] - 1)
+            entry["done"] += 1
+
+    def penalize(self, provider, cookie, kind):
+        cooldown = ACCOUNT_THROTTLE_COOLDOWN if kind == "throttle" else ACCOUNT_QUOTA_COOLDOWN
+        with self.lock:
+            entry = self._entry(provider, cookie)
+            entry["cooldown_until"] = time.time() + cooldown
+            entry["reason"] = kind
+        account_sessions.drop((provider, cookie_key(cookie)))  # 受限账号下次重新登录
+
+account_scheduler = AccountScheduler()
+
+# ==========================================
+# 2.3 失效链接缓存
+# ==========================================
+# 来源链接本身的错误：换账号、立即重试都不会成功 (按出现顺序匹配)
+# 只有网盘明确返回链接层面的错误时才使用这些前缀，限流、登录失效、页面解析失败等一律不算
+DEAD_LINK_MARKERS = (
+    ("提取码失效", "expired"), ("提取码错误", "passcode"), ("空分享", "empty"), ("无文件", "empty"),
+    ("格式错误", "format"),
+)
+# 夸克 token 接口 message 中表示分享本身失效 / 提取码不对的关键字
+QUARK_SHARE_DEAD_HINTS = ("失效", "不存在", "取消", "删除", "违规", "封禁", "过期", "屏蔽")
+QUARK_SHARE_PASSCODE_HINTS = ("提取码", "密码")
+# 百度 share/verify 确认提取码错误的 errno (其余如 -62 验证码、-6 登录失效都与链接无关)
+BAIDU_BAD_PASSCODE_ERRNOS = (-9, -12)
+
+def classify_dead_link(msg):
+    """返回 expired / passcode / empty / format / None"""
+    if not msg: return None
+    for marker, reason in DEAD_LINK_MARKERS:
+        if marker in msg: return reason
+    return None
+
+def quark_share_error(res):
+    """按夸克返回的 code / message 生成错误信息：确认是链接本身的问题才带 DEAD_LINK_MARKERS 前缀"""
+    code, message = res.get('code'), str(res.get('message') or "")
+    if message and "登录" not in message and not classify_account_error(message):
+        if any(hint in message for hint in QUARK_SHARE_DEAD_HINTS): return f"提取码失效: {message}"
+        if any(hint in message for hint in QUARK_SHARE_PASSCODE_HINTS): return f"提取码错误: {message}"
+    return f"分享解析失败(code={code}): {message or '无返回信息'}"
+
+def baidu_verify_error(errno):
+    """share/verify 失败时的错误信息：只有 BAIDU_BAD_PASSCODE_ERRNOS 记为提取码错误"""
+    if errno in BAIDU_BAD_PASSCODE_ERRNOS: return f"提取码错误(errno={errno})"
+    return f"提取码验证失败(errno={errno})"
+
+def share_link_key(link):
+    """规范化来源链接：网盘 + 分享 ID + 提取码，同一分享带不带 ?pwd= 都落到同一条记录"""
+    share_id = link.url.split('/s/')[-1].split('?')[0].split('#')[0]
+    return f"{link.provider}:{share_id}:{link.pwd}"
+
+DEAD_LINK_TTL = 1800      # 失效/提取码错误/空分享链接的缓存时间 (秒)
+DEAD_LINK_CACHE_MAX = 5000
+
+class DeadLinkCache:
+    """
+    失效来源链接的负缓存 (跨任务共享)：命中时直接返回上次的错误，不再请求网盘。
+    只记录 classify_dead_link 能确认的链接层面错误，其余错误下次照常请求。过期与淘汰交给 TTLCache。
+    """
+    def __init__(self):
+        self.cache = TTLCache(DEAD_LINK_TTL, DEAD_LINK_CACHE_MAX)  # share_link_key -> (reason, msg)
+
+    def get(self, link):
+        """命中返回上次的错误信息，否则返回 None"""
+        entry = self.cache.get(share_link_key(link))
+        return entry[1] if entry else None
+
+    def put(self, link, msg):
+        """错误属于来源链接本身时记录下来，返回原因代码 (其他错误返回 None)"""
+        reason = classify_dead_link(msg)
+        if reason: self.cache.put(share_link_key(link), (reason, msg))
+        return reason
+
+dead_links = DeadLinkCache()
+
+# ==========================================
+# 2.4 分阶段流水线
+# ==========================================
+class PipelineStage(NamedTuple):
+    name: str
+    func: Callable    # async func(item) -> None 进入下一阶段；返回其他值则结束并作为结果
+    concurrency: int  # 本阶段同时处理的条目数
+    interval: float = 0.0  # 本阶段相邻两次开工的最小间隔 (秒)，0 为不限速
+    cancel_before: bool = False  # 进入本阶段前检查任务是否已取消 (之后的阶段会把已开始的工作做完)
+
+class StagedPipeline:
+    """
+    把逐条处理拆成多个阶段，阶段之间用 asyncio.Queue 串联，每个阶段有独立的并发上限与速率预算：
+    慢阶段 (如等待转存任务完成) 只占用本阶段的名额，其他条目可以同时在前后阶段推进。
+    工作协程在第一次 submit 时于当前事件循环中启动，close() 时取消。
+    任务已取消时，条目在 cancel_before 阶段之前直接以 cancelled_result 结束。
+    阶段间隔造成的等待记为 provider/account 的 pacing 阶段 (kind=sleep)，计入条目所属任务的时间线。
+    """
+    def __init__(self, stages, cancelled_result=None, provider="", account=""):
+        self.stages = list(stages)
+        self.cancelled_result = cancelled_result
+        self.provider = provider
+        self.account = account
+        self.queues = []
+        self.workers = []
+        self.next_start = [0.0] * len(self.stages)
+
+    def _start(self):
+        self.queues = [asyncio.Queue() for _ in self.stages]
+        self.workers = [asyncio.ensure_future(self._work(idx))
+                        for idx, stage in enumerate(self.stages) for _ in range(max(1, stage.concurrency))]
+
+    async def submit(self, item):
+        """送入第一阶段并等待最终结果；阶段抛出的异常原样抛给调用方"""
+        if not self.workers: self._start()
+        future = asyncio.get_running_loop().create_future()
+        # 工作协程不继承调用方上下文：带上当前链接的 trace，阶段耗时仍记入对应任务
+        await self.queues[0].put((item, future, current_trace.get()))
+        return await future
+
+    async def _pace(self, idx):
+        interval = self.stages[idx].interval
+        if not interval: return
+        # 先预约开工时刻再等待 (读写之间没有 await，无需加锁)，并发的条目依次排到后面
+        loop = asyncio.get_running_loop()
+        start_at = max(self.next_start[idx], loop.time())
+        self.next_start[idx] = start_at + interval
+        wait = start_at - loop.time()
+        if wait > 0:
+            with stage_span(self.provider, self.account, "pacing", kind="sleep"):
+                await asyncio.sleep(wait)
+
+    async def _work(self, idx):
+        stage = self.stages[idx]
+        last = idx == len(self.stages) - 1
+        while True:
+            item, future, trace = await self.queues[idx].get()
+            if future.done(): continue  # 调用方已取消
+            token = current_trace.set(trace)
+            try:
+                await self._pace(idx)
+                if stage.cancel_before and trace_cancelled():
+                    future.set_result(self.cancelled_result)
+                    continue
+                result = await stage.func(item)
+            except Exception as e:
+                if not future.done(): future.set_exception(e)
+                continue
+            finally:
+                current_trace.reset(token)
+            if result is not None or last:
+                if not future.done(): future.set_result(result)
+            else:
+                await self.queues[idx + 1].put((item, future, trace))
+
+    async def close(self):
+        for worker in self.workers: worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+# ==========================================
+# 2.5 预解析与登录态缓存
+# ==========================================
+SHARE_CACHE_TTL = 300       # 预解析结果 (stoken / randsk) 的有效时间 (秒)
+SHARE_CACHE_MAX = 2000
+ACCOUNT_SESSION_TTL = 600   # 已验证的登录态、保存目录 ID 的复用时间 (秒)
+ACCOUNT_SESSION_MAX = 200
+
+# 分享级解析结果 (share_link_key -> resolved)：草稿预解析与预检写入，转存时直接从 save 阶段开始
+share_cache = TTLCache(SHARE_CACHE_TTL, SHARE_CACHE_MAX)
+# 账号级登录态 ((provider, cookie_key) -> dict)：open_quark / open_baidu 命中时跳过登录与目录检查
+account_sessions = TTLCache(ACCOUNT_SESSION_TTL, ACCOUNT_SESSION_MAX)
+
+# ==========================================
+# 3. 引擎类 (含百度调试增强版)
+# ==========================================
+class QuarkEngine:
+    def __init__(self, cookies: str, account: str = ""):
+        self.headers = {
+            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'cookie': cookies,
+            'origin': 'https://pan.quark.cn',
+            'referer': 'https://pan.quark.cn/',
+        }
+        self.client = httpx.AsyncClient(timeout=45.0, headers=self.headers, follow_redirects=True)
+        self.account = account
+        self.inject_cache = None
+        # 单链接流程的各阶段，并发与速率见 QUARK_STAGE_CONCURRENCY / QUARK_STAGE_INTERVAL
+        # 取消只在 resolve / save 之前生效：已转存的链接继续完成分享，不在网盘里留下无主副本
+        self.pipeline = StagedPipeline(
+            (PipelineStage(name, func, QUARK_STAGE_CONCURRENCY[name], QUARK_STAGE_INTERVAL.get(name, 0.0),
+                           cancel_before=name in ("resolve", "save"))
+             for name, func in (("resolve", self._stage_resolve), ("save", self._stage_save),
+                                ("task_wait", self._stage_task_wait), ("share", self._stage_share))),
+            cancelled_result=(None, "已取消", None), provider="quark", account=account
+        )
+
+    async def close(self):
+        await self.pipeline.close()
+        await self.client.aclose()
+
+    def _params(self):
+        return {'pr': 'ucpro', 'fr': 'pc', '__dt': random.randint(100, 9999), '__t': int(time.time() * 1000)}
+
+    def _span(self, stage, is_inject=False, kind="network"):
+        return stage_span("quark", self.account, f"inject_{stage}" if is_inject else stage, kind)
+
+    async def check_login(self):
+        try:
+            r = await self.client.get('https://pan.quark.cn/account/info', params=self._params())
+            data = r.json()
+            if (data.get('code') == 0 or data.get('code') == 'OK') and data.get('data'):
+                return data['data'].get('nickname', '用户')
+        except: pass
+        return None
+
+    async def list_dir(self, pdir_fid: str):
+        """分页列出目录下全部条目"""
+        items, page = [], 1
+        while True:
+            params = self._params()
+            params.update({'pdir_fid': pdir_fid, '_page': page, '_size': QUARK_LIST_PAGE_SIZE, '_fetch_total': 1, '_sort': 'updated_at:asc'})
+            r = await self.client.get('https://drive-pc.quark.cn/1/clouddrive/file/sort', params=params)
+            batch = r.json().get('data', {}).get('list', [])
+            items.extend(batch)
+            if len(batch) < QUARK_LIST_PAGE_SIZE: return items
+            page += 1
+
+    async def list_shared_fids(self):
+        """
+        读取本账号的分享记录，返回仍然有效的分享所包含的 fid 集合；读取失败返回 None (调用方不应删除任何文件)。
+        分享记录只带首个 fid (first_fid)：包含多个条目的分享再读取其分享页，自己的分享页中 fid 即网盘内的 fid。
+        """
+        shared, page = set(), 1
+        now = time.time()
+        try:
+            while True:
+                params = self._params()
+                params.update({'_page': page, '_size': QUARK_SHARE_LIST_PAGE_SIZE, '_fetch_total': 1,
+                               '_order_field': 'created_at', '_order_type': 'desc'})
+                r = await self.client.get('https://drive-pc.quark.cn/1/clouddrive/share/mypage/detail', params=params)
+                res = r.json()
+                if res.get('code') not in [0, 'OK']: return None
+                batch = (res.get('data') or {}).get('list', [])
+                for item in batch:
+                    # status 1 为正常；expired_at 为毫秒，0 表示永久
+                    if item.get('status') != 1: continue
+                    if item.get('expired_at') and item['expired_at'] / 1000 < now: continue
+                    if item.get('first_fid'): shared.add(item['first_fid'])
+                    if int(item.get('file_num') or 1) > 1:
+                        resolved, _ = await self.resolve_share(f"https://pan.quark.cn/s/{item.get('pwd_id')}")
+                        if not resolved: return None
+                        shared.update(resolved['fids'])
+                if len(batch) < QUARK_SHARE_LIST_PAGE_SIZE: return shared
+                page += 1
+        except: return None
+
+    async def delete_files(self, fids):
+        """批量删除，返回成功提交的条目数"""
+        deleted = 0
+        for i in range(0, len(fids), QUARK_DELETE_BATCH):
+            batch = fids[i:i + QUARK_DELETE_BATCH]
+            r = await self.client.post('https://drive-pc.quark.cn/1/clouddrive/file/delete',
+                                       json={"action_type": 2, "filelist": batch, "exclude_fids": []}, params=self._params())
+            if r.json().get('code') in [0, 'OK']: deleted += len(batch)
+        return deleted
+
+    async def get_used_capacity(self):
+        try:
+            params = self._params()
+            params.update({'fetch_subscribe': 'true', 'fetch_identity': 'true', '_ch': 'home'})
+            r = await self.client.get('https://drive-pc.quark.cn/1/clouddrive/member', params=params)
+            return int(r.json().get('data', {}).get('use_capacity', 0))
+        except: return None
+
+    async def get_folder_id(self, path: str):
+        parts = path.split('/')
+        curr_id = '0'
+        for part in parts:
+            if not part: continue
+            found = False
+            params = self._params()
+            params.update({'pdir_fid': curr_id, '_page': 1, '_size': 50, '_fetch_total': 'false', '_sort': 'file_type:asc,updated_at:desc'})
+            try:
+                r = await self.client.get('https://drive-pc.quark.cn/1/clouddrive/file/sort', params=params)
+                for item in r.json().get('data', {}).get('list', []):
+                    if item['file_name'] == part and item['dir']:
+                        curr_id = item['fid']
+                        found = True
+                        break
+            except: pass
+            if not found: return None 
+        return curr_id
+
+    async def _fetch_detail_page(self, pwd_id, stoken, page):
+        params = self._params()
+        params.update({"pwd_id": pwd_id, "stoken": stoken, "pdir_fid": "0", "_page": page,
+                       "_size": QUARK_DETAIL_PAGE_SIZE, "_fetch_total": 1})
+        r = await self.client.get("https://drive-pc.quark.cn/1/clouddrive/share/sharepage/detail", params=params)
+        return r.json()
+
+    @staticmethod
+    def _page_list(res):
+        """单页结果的文件列表；code 非 0 或结构不对时返回 None"""
+        if res.get('code', 0) != 0 or not isinstance(res.get('data'), dict): return None
+        return res['data'].get('list', [])
+
+    async def fetch_share_items(self, pwd_id, stoken):
+        """
+        分页获取分享根目录：首页拿到总数后，其余页并发请求。
+        任意一页失败、或合并后的条数与 _total 不符时返回 None (不是空分享)，避免只转存了部分文件。
+        """
+        first = await self._fetch_detail_page(pwd_id, stoken, 1)
+        items = self._page_list(first)
+        if items is None: return None
+        total = (first.get('metadata') or {}).get('_total')
+
+        if total is None:
+            # 未返回总数时退化为顺序翻页
+            page = 1
+            while len(items) == page * QUARK_DETAIL_PAGE_SIZE:
+                page += 1
+                page_items = self._page_list(await self._fetch_detail_page(pwd_id, stoken, page))
+                if page_items is None: return None
+                items.extend(page_items)
+            return items
+
+        page_count = -(-int(total) // QUARK_DETAIL_PAGE_SIZE)
+        if page_count > 1:
+            sem = asyncio.Semaphore(QUARK_DETAIL_CONCURRENCY)
+            async def fetch(page):
+                async with sem:
+                    return await self._fetch_detail_page(pwd_id, stoken, page)
+            pages = await asyncio.gather(*(fetch(p) for p in range(2, page_count + 1)))
+            for res in pages:
+                page_items = self._page_list(res)
+                if page_items is None: return None
+                items.extend(page_items)
+        if len(items) != int(total): return None
+        return items
+
+    async def save_batches(self, source_fids, source_tokens, target_fid, pwd_id, stoken):
+        """
+        按 QUARK_SAVE_BATCH 拆分 fid_list 并发转存，返回 (已受理批次的 task_id 列表, 首个错误信息或 None)。
+        有批次失败时，其余批次可能已被受理，调用方需要清理这些任务存入的文件。
+        """
+        sem = asyncio.Semaphore(QUARK_SAVE_CONCURRENCY)
+        async def save(offset):
+            async with sem:
+                save_data = {"fid_list": source_fids[offset:offset + QUARK_SAVE_BATCH],
+                             "fid_token_list": source_tokens[offset:offset + QUARK_SAVE_BATCH],
+                             "to_pdir_fid": target_fid, "pwd_id": pwd_id, "stoken": stoken, "pdir_fid": "0", "scene": "link"}
+                r = await self.client.post("https://drive.quark.cn/1/clouddrive/share/sharepage/save", json=save_data, params=self._params())
+                return r.json()
+
+        results = await asyncio.gather(*(save(offset) for offset in range(0, len(source_fids), QUARK_SAVE_BATCH)))
+        task_ids, err = [], None
+        for res in results:
+            if res.get('code') not in [0, 'OK']:
+                if err is None: err = res.get('message')
+                continue
+            task_ids.append(res.get('data', {}).get('task_id'))
+        return task_ids, err
+
+    async def wait_tasks(self, task_ids):
+        """轮询转存任务直至全部完成或超时，返回 (存入的顶层 fid 列表, 未完成的 task_id 列表)"""
+        pending, results = list(task_ids), {}
+        for _ in range(8):
+            await asyncio.sleep(1)
+            done = await asyncio.gather(*(self._task_result(tid) for tid in pending))
+            results.update((tid, data) for tid, data in zip(pending, done) if data)
+            pending = [tid for tid in pending if tid not in results]
+            if not pending: break
+        top_fids = [fid for tid in task_ids if tid in results
+                    for fid in (results[tid].get('save_as') or {}).get('save_as_top_fids') or []]
+        return top_fids, pending
+
+    async def _task_result(self, task_id):
+        """转存任务完成时返回任务数据 (含 save_as.save_as_top_fids)，未完成或请求失败返回 None"""
+        try:
+            params = self._params()
+            params['task_id'] = task_id
+            r = await self.client.get("https://drive-pc.quark.cn/1/clouddrive/task", params=params)
+            data = r.json().get('data') or {}
+            return data if data.get('status') == 2 else None
+        except: return None
+
+    async def resolve_share(self, url: str, is_inject: bool = False):
+        """
+        换取 stoken 并读取分享根目录，不改动引擎状态 (可并发调用，供预检复用)。
+        返回 (resolved, 错误信息)；resolved 含 pwd_id/stoken/fids/tokens/first_name/items(根目录条目数)/size
+        """
+        try:
+            if '/s/' not in url: return None, "格式错误"
+            pwd_id = url.split('/s/')[-1].split('?')[0].split('#')[0]
+            match = re.search(r'[?&]pwd=([a-zA-Z0-9]+)', url)
+            passcode = match.group(1) if match else ""
+            
+            with self._span("token", is_inject) as span:
+                r = await self.client.post("https://drive-pc.quark.cn/1/clouddrive/share/sharepage/token", 
+                                         json={"pwd_id": pwd_id, "passcode": passcode}, params=self._params())
+                res = r.json()
+                stoken = (res.get('data') or {}).get('stoken')
+                if not stoken:
+                    span.fail()
+                    return None, quark_share_error(res)
+            
+            with self._span("detail", is_inject) as span:
+                items = await self.fetch_share_items(pwd_id, stoken)
+                if items is None:
+                    span.fail()
+                    return None, "分享目录读取失败"
+                if not items:
+                    span.fail()
+                    return None, "空分享"
+            return {
+                'pwd_id': pwd_id, 'stoken': stoken,
+                'fids': [i['fid'] for i in items], 'tokens': [i['share_fid_token'] for i in items],
+                'first_name': items[0]['file_name'],
+                'items': len(items), 'size': sum(int(i.get('size') or 0) for i in items)
+            }, ""
+        except: return None, "解析异常"
+
+    async def process_url(self, url: str, target_fid: str, is_inject: bool = False, resolved=None):
+        """
+        resolved: 预检阶段已解析的分享数据，传入时跳过 token/detail 请求。
+        普通链接交给 self.pipeline 分阶段处理；广告植入只转存，直接顺序执行。
+        """
+        if not is_inject:
+            return await self.pipeline.submit({'url': url, 'target_fid': target_fid, 'resolved': resolved})
+
+        if self.inject_cache:
+            resolved = self.inject_cache
+        elif resolved is None:
+            resolved, err = await self.resolve_share(url, is_inject=True)
+            if not resolved: return None, err, None
+            self.inject_cache = resolved
+        return await self._stage_save({'target_fid': target_fid, 'resolved': resolved, 'is_inject': True}) \
+            or ("INJECT_OK", "植入成功", None)
+
+    # --- 流水线各阶段：返回 None 进入下一阶段，返回 (新链接, 消息, new_fid) 则结束 ---
+    async def _stage_resolve(self, job):
+        if job['resolved'] is None:
+            job['resolved'], err = await self.resolve_share(job['url'])
+            if not job['resolved']: return None, err, None
+
+    async def _stage_save(self, job):
+        resolved, is_inject = job['resolved'], job.get('is_inject', False)
+        try:
+            with self._span("save", is_inject) as span:
+                job['task_ids'], err = await self.save_batches(resolved['fids'], resolved['tokens'], job['target_fid'],
+                                                               resolved['pwd_id'], resolved['stoken'])
+                if err is not None: span.fail()
+        except: return None, "转存请求失败", None
+        if err is None: return None
+        if not job['task_ids']: return None, f"转存失败: {err}", None
+
+        # 部分批次已受理：等这些任务完成后删掉存入的文件，不在目标目录留下不完整的资源
+        with self._span("cleanup", is_inject, kind="wait") as span:
+            top_fids, pending = await self.wait_tasks(job['task_ids'])
+            deleted = await self.delete_files(top_fids) if top_fids else 0
+            if pending or deleted < len(top_fids):
+                span.fail()
+                return None, f"部分转存: {err} (已存入的部分文件未能清理)", None
+        return None, f"转存失败: {err}", None
+
+    async def _stage_task_wait(self, job):
+        """
+        等待全部转存任务完成，并从任务结果 (save_as.save_as_top_fids) 取得本链接存入的顶层条目。
+        多个链接并发存入同一目录，不能再按文件名或"最新条目"在目录里查找。
+        """
+        with self._span("task_wait", kind="wait") as span:
+            top_fids, pending = await self.wait_tasks(job['task_ids'])
+            if pending: span.fail("timeout")
+        if pending or not top_fids: return None, "✅ 已存入网盘 (但无法获取文件ID，未分享)", None
+        job['top_fids'] = top_fids
+
+    async def _stage_share(self, job):
+        # 分享本链接存入的全部顶层条目；第一个条目作为广告植入的目标
+        new_fid = job['top_fids'][0]
+        share_data = {"fid_list": job['top_fids'], "title": job['resolved']['first_name'], "url_type": 1, "expired_type": 1}
+        try:
+            with self._span("share") as span:
+                r = await self.client.post("https://drive-pc.quark.cn/1/clouddrive/share", json=share_data, params=self._params())
+                res = r.json()
+                if res.get('code') != 0 and res.get('code') != 'OK':
+                    span.fail()
+                    return None, f"✅ 已存入网盘 (但分享被拦截: {res.get('message')})", None
+                    
+                share_task_id = res.get('data', {}).get('task_id')
+                await asyncio.sleep(0.5)
+                params = self._params()
+                params.update({'task_id': share_task_id, 'retry_index': 0})
+                r = await self.client.get("https://drive-pc.quark.cn/1/clouddrive/task", params=params)
+                share_id = r.json().get('data', {}).get('share_id')
+            
+            with self._span("password"):
+                r = await self.client.post("https://drive-pc.quark.cn/1/clouddrive/share/password", json={"share_id": share_id}, params=self._params())
+                return r.json()['data']['share_url'], "成功", new_fid
+        except: return None, "✅ 已存入网盘 (但分享创建异常)", None
+
+class BaiduEngine:
+    def __init__(self, cookies: str, account: str = ""):
+        self.s = requests.Session()
+        self.account = account
+        # 调试：打印 Cookie 前10位，确认是否传入
+        print(f"\n[BaiduEngine] 初始化... Cookie长度: {len(cookies) if cookies else 0}")
+        if cookies:
+            print(f"[BaiduEngine] Cookie前缀: {cookies[:20]}...")
+        else:
+            print("[BaiduEngine] ❌ 警告：Cookie 为空！")
+
+        # 账号级基础凭据，初始化后只读；分享级的 BDCLND 通过 share_headers() 叠加在副本上，
+        # 同一个引擎可以在多个线程中同时处理不同的加密分享
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36',
+            'Referer': 'https://pan.baidu.com',
+            'Cookie': "".join(cookies.split()) if cookies else ""
+        }
+        self.bdstoken = ''
+        self.lock = threading.Lock()
+        self.inject_cache = None  # 植入分享的解析结果 (含 randsk)，整体替换，读写都持有 self.lock
+        requests.packages.urllib3.disable_warnings()
+
+    def _span(self, stage, is_inject=False):
+        return stage_span("baidu", self.account, f"inject_{stage}" if is_inject else stage)
+
+    @staticmethod
+    def with_bdclnd(cookie, bdclnd):
+        current = dict(i.split('=', 1) for i in cookie.split(';') if '=' in i)
+        current['BDCLND'] = bdclnd
+        return ';'.join([f'{k}={v}' for k,v in current.items()])
+
+    def share_headers(self, bdclnd=None):
+        """单个分享使用的请求头：基础凭据 + 该分享的 BDCLND (不改动 self.headers)"""
+        if not bdclnd: return self.headers
+        return {**self.headers, 'Cookie': self.with_bdclnd(self.headers['Cookie'], bdclnd)}
+
+    def verify_passcode(self, surl, pwd, headers=None):
+        """提交提取码，返回接口 JSON (成功时含 randsk)"""
+        r = self.s.post('https://pan.baidu.com/share/verify', 
+                        params={'surl': surl, 't': int(time.time()*1000), 'bdstoken': self.bdstoken, 'channel': 'chunlei', 'web': 1, 'clienttype': 0},
+                        data={'pwd': pwd, 'vcode': '', 'vcode_str': ''}, headers=headers or self.headers, verify=False)
+        print(f"[BaiduEngine] 验证结果: {r.text}")
+        return r.json()
+
+    @retry(stop_max_attempt_number=2)
+    def init_token(self):
+        url = 'https://pan.baidu.com/api/gettemplatevariable'
+        print("[BaiduEngine] 正在获取 Token...")
+        try:
+            r = self.s.get(url, params={'fields': '["bdstoken","token","uk","isdocuser"]'}, headers=self.headers, verify=False)
+            res = r.json()
+            print(f"[BaiduEngine] Token 响应: {str(res)[:100]}...")
+            if res.get('errno') == 0:
+                self.bdstoken = res['result']['bdstoken']
+                print(f"[BaiduEngine] ✅ 获取 Token 成功: {self.bdstoken}")
+                return True
+            print(f"[BaiduEngine] ❌ 获取 Token 失败: errno={res.get('errno')}")
+            return False
+        except Exception as e:
+            print(f"[BaiduEngine] ❌ init_token 异常: {e}")
+            return False
+
+    def list_dir(self, path):
+        """分页列出目录下全部条目"""
+        items, page = [], 1
+        while True:
+            r = self.s.get('https://pan.baidu.com/api/list',
+                           params={'dir': path, 'bdstoken': self.bdstoken, 'page': page, 'num': BAIDU_LIST_PAGE_SIZE, 'order': 'time'},
+                           headers=self.headers, verify=False)
+            batch = r.json().get('list', [])
+            items.extend(batch)
+            if len(batch) < BAIDU_LIST_PAGE_SIZE: return items
+            page += 1
+
+    def list_shared_fs_ids(self):
+        """
+        读取本账号的分享记录 (share/record)，返回仍然有效的分享所包含的 fs_id 集合 (字符串)；
+        读取失败返回 None (调用方不应删除任何文件)
+        """
+        shared, page = set(), 1
+        now = time.time()
+        try:
+            while True:
+                r = self.s.get('https://pan.baidu.com/share/record',
+                               params={'page': page, 'num': BAIDU_SHARE_RECORD_PAGE_SIZE, 'order': 'ctime', 'desc': 1,
+                                       'bdstoken': self.bdstoken, 'channel': 'chunlei', 'web': 1, 'clienttype': 0},
+                               headers=self.headers, verify=False, timeout=15)
+                res = r.json()
+                if res.get('errno') != 0: return None
+                batch = res.get('list', [])
+                for item in batch:
+                    # status 0 为正常；expiredTime 为秒，0 表示永久
+                    if item.get('status') != 0: continue
+                    if item.get('expiredTime') and item['expiredTime'] < now: continue
+                    shared.update(str(fs_id) for fs_id in item.get('fsIds') or [])
+                if len(batch) < BAIDU_SHARE_RECORD_PAGE_SIZE: return shared
+                page += 1
+        except Exception as e:
+            print(f"[BaiduEngine] share/record 异常: {e}")
+            return None
+
+    def delete_paths(self, paths):
+        """批量删除 (filemanager)，返回成功提交的条目数"""
+        deleted = 0
+        for i in range(0, len(paths), BAIDU_DELETE_BATCH):
+            batch = paths[i:i + BAIDU_DELETE_BATCH]
+            r = self.s.post('https://pan.baidu.com/api/filemanager',
+                            params={'opera': 'delete', 'async': 2, 'onnest': 'fail', 'bdstoken': self.bdstoken,
+                                    'channel': 'chunlei', 'web': 1, 'clienttype': 0},
+                            data={'filelist': json.dumps(batch, ensure_ascii=False)}, headers=self.headers, verify=False)
+            if r.json().get('errno') == 0: deleted += len(batch)
+        return deleted
+
+    def get_used_capacity(self):
+        try:
+            r = self.s.get('https://pan.baidu.com/api/quota', params={'checkexpire': 1, 'checkfree': 1, 'bdstoken': self.bdstoken},
+                           headers=self.headers, verify=False)
+            return int(r.json().get('used', 0))
+        except: return None
+
+    def check_dir_exists(self, path):
+        if not path.startswith("/"): path = "/" + path
+        try:
+            r = self.s.get('https://pan.baidu.com/api/list', params={'dir': path, 'bdstoken': self.bdstoken, 'start': 0, 'limit': 1}, headers=self.headers, verify=False)
+            exists = r.json().get('errno') == 0
+            print(f"[BaiduEngine] 检查目录 [{path}] 存在: {exists}")
+            return exists
+        except: return False
+
+    def create_dir(self, path):
+        """创建目录，成功时返回响应 (含 fs_id 与最终 path，重名时服务端可能改名)"""
+        if not path.startswith("/"): path = "/" + path
+        print(f"[BaiduEngine] 尝试创建目录: {path}")
+        try:
+            res = self.s.post('https://pan.baidu.com/api/create', params={'a': 'commit', 'bdstoken': self.bdstoken}, 
+                        data={'path': path, 'isdir': 1, 'block_list': '[]'}, headers=self.headers, verify=False).json()
+            print(f"[BaiduEngine] 创建目录响应: {res}")
+            if res.get('errno') == 0: return res
+        except Exception as e: 
+            print(f"[BaiduEngine] 创建目录异常: {e}")
+        return None
+
+    def provision_dirs(self, paths):
+        """并发预建一批目录，返回 {path: api/create 响应或 None}"""
+        if not paths: return {}
+        with ThreadPoolExecutor(max_workers=BAIDU_MKDIR_CONCURRENCY) as pool:
+            return dict(zip(paths, pool.map(self.create_dir, paths)))
+
+    def get_path_fs_id(self, path):
+        """按路径直接查询元数据 (filemetas)，与目录下文件数量无关"""
+        try:
+            r = self.s.get('https://pan.baidu.com/api/filemetas',
+                           params={'target': json.dumps([path], ensure_ascii=False), 'dlink': 0, 'bdstoken': self.bdstoken,
+                                   'channel': 'chunlei', 'web': 1, 'clienttype': 0},
+                           headers=self.headers, verify=False)
+            info = r.json().get('info') or []
+            if info: return info[0].get('fs_id')
+        except Exception as e:
+            print(f"[BaiduEngine] filemetas 异常: {e}")
+        return None
+
+    def list_share_root(self, shorturl, headers=None):
+        """通过 share/list 接口分页获取分享根目录，返回 (shareid, uk, 条目列表)；接口不可用时返回 None"""
+        shareid, uk, entries = None, None, []
+        page = 1
+        while True:
+            r = self.s.get('https://pan.baidu.com/share/list',
+                           params={'shorturl': shorturl, 'root': 1, 'page': page, 'num': BAIDU_SHARE_PAGE_SIZE,
+                                   'order': 'other', 'desc': 1, 'showempty': 0, 'web': 5, 'app_id': 250528,
+                                   'channel': 'chunlei', 'clienttype': 0, 'bdstoken': self.bdstoken},
+                           headers=headers or self.headers, verify=False, timeout=15)
+            res = r.json()
+            if res.get('errno') != 0:
+                print(f"[BaiduEngine] share/list 返回 errno={res.get('errno')}")
+                return None
+            shareid = shareid or res.get('share_id') or res.get('shareid')
+            uk = uk or res.get('uk') or res.get('share_uk')
+            items = res.get('list', [])
+            entries.extend(items)
+            if len(items) < BAIDU_SHARE_PAGE_SIZE: break
+            page += 1
+        if not shareid or not uk: return None
+        return str(shareid), str(uk), entries
+
+    def list_share_json(self, shorturl, headers=None):
+        """返回 (shareid, uk, fs_id 列表)；接口不可用时返回 None"""
+        root = self.list_share_root(shorturl, headers)
+        if not root: return None
+        shareid, uk, entries = root
+        return shareid, uk, [str(item['fs_id']) for item in entries]
+
+    def probe_share(self, url, pwd):
+        """
+        预检：验证提取码并读取分享根目录，不转存。
+        BDCLND 只写入本次请求的 share_headers，可在多个线程中并发调用。
+        返回 (resolved, 错误信息)；接口异常等无法判断时两者均为 None
+        """
+        clean_url = url.split('?')[0]
+        surl = re.search(r'(?:surl=|/s/1|/s/)([\w\-]+)', clean_url)
+        if not surl: return None, "URL格式错误"
+        headers, randsk = self.headers, None
+        try:
+            if pwd:
+                with self._span("verify") as span:
+                    res = self.verify_passcode(surl.group(1), pwd)
+                    if res.get('errno') != 0:
+                        span.fail()
+                        return None, baidu_verify_error(res.get('errno'))
+                    randsk = res['randsk']
+                    headers = self.share_headers(randsk)
+            with self._span("share_list") as span:
+                root = self.list_share_root(surl.group(1), headers)
+                if not root:
+                    span.fail()
+                    return None, None
+        except Exception as e:
+            print(f"[BaiduEngine] 预检异常: {e}")
+            return None, None
+        shareid, uk, entries = root
+        if not entries: return None, "解析成功但无文件"
+        return {
+            'shareid': shareid, 'uk': uk, 'fs_ids': [str(item['fs_id']) for item in entries], 'randsk': randsk,
+            'items': len(entries), 'size': sum(int(item.get('size') or 0) for item in entries)
+        }, ""
+
+    def scrape_share_page(self, clean_url, headers=None):
+        """回退方案：流式读取分享页，解析到内嵌数据块 (locals.mset) 结束即断开"""
+        content = ""
+        with self.s.get(clean_url, headers=headers or self.headers, verify=False, stream=True, timeout=20) as r:
+            r.encoding = r.encoding or 'utf-8'
+            for chunk in r.iter_content(chunk_size=16384, decode_unicode=True):
+                content += chunk
+                block_start = content.find('locals.mset(')
+                if block_start != -1 and content.find('});', block_start) != -1: break
+
+        if "验证码" in content or "verify" in content:
+            print("[BaiduEngine] ❌ 警告：页面包含验证码关键字！IP可能被拦截。")
+        try:
+            shareid = re.search(r'"shareid":(\d+?),', content).group(1)
+            uk = re.search(r'"share_uk":"(\d+?)",', content).group(1)
+            fs_id_list = re.findall(r'"fs_id":(\d+?),', content)
+            return shareid, uk, fs_id_list
+        except Exception:
+            print(f"[BaiduEngine] ❌ 正则解析失败。页面内容摘要: {content[:200]}")
+            return None
+
+    def resolve_share(self, clean_url, is_inject=False, headers=None):
+        surl = re.search(r'(?:surl=|/s/1|/s/)([\w\-]+)', clean_url)
+        if surl:
+            with self._span("share_list", is_inject) as span:
+                try:
+                    share_info = self.list_share_json(surl.group(1), headers)
+                except Exception as e:
+                    print(f"[BaiduEngine] share/list 异常: {e}")
+                    share_info = None
+                if share_info: return share_info
+                span.fail()
+        print("[BaiduEngine] 回退：请求页面内容...")
+        with self._span("page", is_inject) as span:
+            share_info = self.scrape_share_page(clean_url, headers)
+            if not share_info: span.fail()
+            return share_info
+
+    def _transfer(self, shareid, uk, fs_ids, save_path, headers=None):
+        r = self.s.post('https://pan.baidu.com/share/transfer', 
+                        params={'shareid': shareid, 'from': uk, 'bdstoken': self.bdstoken},
+                        data={'fsidlist': f"[{','.join(fs_ids)}]", 'path': save_path}, 
+                        headers=headers or self.headers, verify=False, timeout=20)
+        return r.json()
+
+    def transfer_batches(self, shareid, uk, fs_id_list, save_path, headers=None):
+        """
+        按 BAIDU_TRANSFER_BATCH 拆分 fsidlist 并发转存，合并为一个响应：
+        全部成功为 0；部分"已存在"(12) 视为成功；否则返回第一个真实错误码。
+        """
+        batches = [fs_id_list[i:i + BAIDU_TRANSFER_BATCH] for i in range(0, len(fs_id_list), BAIDU_TRANSFER_BATCH)]
+        if len(batches) == 1:
+            return self._transfer(shareid, uk, batches[0], save_path, headers)
+        with ThreadPoolExecutor(max_workers=BAIDU_TRANSFER_CONCURRENCY) as pool:
+            results = list(pool.map(lambda batch: self._transfer(shareid, uk, batch, save_path, headers), batches))
+
+        errnos = [res.get('errno') for res in results]
+        merged = {'errno': 0, 'batches': len(batches), 'extra': {'list': []}}
+        for res in results:
+            merged['extra']['list'].extend((res.get('extra') or {}).get('list', []))
+        real_errors = [e for e in errnos if e not in (0, 12)]
+        if real_errors: merged['errno'] = real_errors[0]
+        elif all(e == 12 for e in errnos): merged['errno'] = 12
+        return merged
+
+    def process_url(self, url_info: dict, root_path: str, is_inject: bool = False):
+        print(f"\n--- [BaiduEngine] 开始处理 URL: {url_info.get('url')} ---")
+        
+        with self.lock:
+            inject_cache = self.inject_cache if is_inject else None
+        if inject_cache:
+            shareid, uk, fs_id_list = inject_cache['shareid'], inject_cache['uk'], inject_cache['fs_ids']
+            headers = self.share_headers(inject_cache['randsk'])
+            print("[BaiduEngine] 使用缓存数据植入")
+        elif url_info.get('resolved'):
+            # 预检阶段已验证提取码并解析 (probe_share)，只需带上该分享的 BDCLND
+            resolved = url_info['resolved']
+            shareid, uk, fs_id_list = resolved['shareid'], resolved['uk'], resolved['fs_ids']
+            headers = self.share_headers(resolved.get('randsk'))
+            print(f"[BaiduEngine] 使用预检结果: shareid={shareid}, uk={uk}, 文件数={len(fs_id_list)}")
+        else:
+            try:
+                url = url_info['url']
+                pwd = url_info['pwd']
+                clean_url = url.split('?')[0]
+                randsk = None
+
+                if pwd:
+                    surl = re.search(r'(?:surl=|/s/1|/s/)([\w\-]+)', clean_url)
+                    if not surl: return None, "URL格式错误", None
+                    print(f"[BaiduEngine] 验证提取码: {pwd} surl: {surl.group(1)}")
+                    with self._span("verify", is_inject) as span:
+                        res = self.verify_passcode(surl.group(1), pwd)
+                        if res.get('errno') == 0:
+                            randsk = res['randsk']
+                        else:
+                            span.fail()
+                            return None, baidu_verify_error(res.get('errno')), None
+
+                headers = self.share_headers(randsk)
+                share_info = self.resolve_share(clean_url, is_inject, headers)
+                if not share_info: return None, "页面解析失败(可能IP被拦截)", None
+                shareid, uk, fs_id_list = share_info
+                print(f"[BaiduEngine] 解析成功: shareid={shareid}, uk={uk}, 文件数={len(fs_id_list)}")
+
+                if not fs_id_list: return None, "解析成功但无文件", None
+
+                if is_inject:
+                    with self.lock:
+                        self.inject_cache = {
+                            'shareid': shareid, 'uk': uk, 'fs_ids': tuple(fs_id_list), 'randsk': randsk
+                        }
+            except Exception as e: return None, f"异常: {str(e)[:20]}", None
+
+        try:
+            if is_inject:
+                save_path = root_path
+            elif url_info.get('dir'):
+                # 任务开始前已批量预建 (provision_dirs)
+                save_path = url_info['dir'].get('path') or f"{root_path}/{url_info['folder']}"
+                target_fsid = url_info['dir'].get('fs_id')
+            else:
+                if url_info.get('folder'):
+                    final_folder = url_info['folder']
+                else:
+                    safe_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=4))
+                    final_folder = f"{url_info.get('name', 'Temp')}_{safe_suffix}"
+                save_path = f"{root_path}/{final_folder}"
+                with self._span("mkdir"):
+                    created = self.create_dir(save_path) 
+                target_fsid = created.get('fs_id') if created else None
+                if created and created.get('path'): save_path = created['path']
+
+            print(f"[BaiduEngine] 开始转存至: {save_path}")
+            with self._span("transfer", is_inject) as span:
+                try:
+                    res = self.transfer_batches(shareid, uk, list(fs_id_list), save_path, headers)
+                    print(f"[BaiduEngine] 转存响应: {res}")
+                except requests.exceptions.RequestException as e:
+                    print(f"[BaiduEngine] 转存请求超时: {e}")
+                    span.fail("timeout")
+                    return None, "转存请求超时(文件可能过大)", None
+                if res.get('errno') not in (0, 12): span.fail()
+
+            if res.get('errno') == 12: 
+                 if is_inject: return "INJECT_OK", "文件已存在", save_path
+                 return None, "转存失败(文件已存在)", None
+            
+            if res.get('errno') != 0: 
+                errno = res.get('errno')
+                err_msg = f"转存失败({errno})"
+                if errno == -10: err_msg = "容量不足或文件数超限"
+                elif errno == -33: err_msg = "文件数超出限制(非会员500)"
+                elif errno == -6: err_msg = "Cookie身份失效(-6)"
+                elif errno == 4: err_msg = "文件路径无效或包含违规内容(errno:4)"
+                print(f"[BaiduEngine] ❌ 错误详情: {err_msg}")
+                return None, err_msg, None
+
+            if is_inject: return "INJECT_OK", "成功", save_path
+
+            if not target_fsid:
+                print("[BaiduEngine] 创建响应无 fs_id，按路径查询...")
+                with self._span("locate") as span:
+                    target_fsid = self.get_path_fs_id(save_path)
+                    if not target_fsid: span.fail()
+            
+            if not target_fsid: 
+                print("[BaiduEngine] ❌ 未在目录下找到刚转存的文件")
+                return None, "✅ 已存入网盘 (获取目录失败)", None
+
+            new_pwd = ''.join(random.choices(string.ascii_letters + string.digits, k=4))
+            print("[BaiduEngine] 创建分享链接...")
+            with self._span("share") as span:
+                r = self.s.post('https://pan.baidu.com/share/set', 
+                                params={'bdstoken': self.bdstoken, 'channel': 'chunlei', 'clienttype': 0, 'web': 1},
+                                data={'period': 0, 'pwd': new_pwd, 'fid_list': f'[{target_fsid}]', 'schannel': 4}, headers=self.headers, verify=False)
+                print(f"[BaiduEngine] 分享响应: {r.text}")
+                if r.json()['errno'] != 0: span.fail()
+            
+            if r.json()['errno'] == 0:
+                return f"{r.json()['link']}?pwd={new_pwd}", "成功", save_path 
+            return None, "✅ 已存入网盘 (分享失败)", None
+
+        except Exception as e:
+            print(f"[BaiduEngine] ❌ 最终异常: {e}")
+            return None, f"发生异常: {str(e)[:20]}...", None
+
+# ==========================================
+# 4. 常量定义
+# ==========================================
+QUARK_SAVE_PATH = "来自：分享/LinkChanger"
+BAIDU_SAVE_PATH = "/我的资源/LinkChanger"
+BAIDU_SHARE_PAGE_SIZE = 100
+QUARK_DETAIL_PAGE_SIZE = 50
+QUARK_DETAIL_CONCURRENCY = 4
+QUARK_SAVE_BATCH = 100          # sharepage/save 单次 fid_list 上限
+QUARK_SAVE_CONCURRENCY = 2
+# 夸克单链接流水线：每个阶段每账号的并发上限，与可选的开工间隔 (秒)
+# 转存的开工间隔代替了原先每个链接之后 2~4 秒的节流等待
+QUARK_STAGE_CONCURRENCY = {"resolve": 4, "save": 2, "task_wait": 16, "share": 2}
+QUARK_STAGE_INTERVAL = {"save": 2.0, "share": 0.5}
+# 未指定 concurrency 时每个夸克账号同时在途的链接数：与流水线各阶段名额之和一致
+QUARK_INFLIGHT_PER_ACCOUNT = sum(QUARK_STAGE_CONCURRENCY.values())
+BAIDU_TRANSFER_BATCH = 500      # 非会员单次转存上限 (errno -33)
+BAIDU_TRANSFER_CONCURRENCY = 2
+BAIDU_MKDIR_CONCURRENCY = 4
+QUARK_LIST_PAGE_SIZE = 100
+QUARK_DELETE_BATCH = 100
+QUARK_SHARE_LIST_PAGE_SIZE = 50
+BAIDU_LIST_PAGE_SIZE = 1000
+BAIDU_DELETE_BATCH = 100
+BAIDU_SHARE_RECORD_PAGE_SIZE = 100
+HEALTH_CHECK_CONCURRENCY = 8
+PREFLIGHT_CONCURRENCY = 8       # 预检阶段同时探测的链接数 (只读请求，不转存)
+WARMUP_CONCURRENCY = 4          # 同时预热登录的账号数
+BULK_DIR = "bulk_jobs"          # 大文件任务的上传与结果文件
+BULK_RECORD_MAX_LINES = 200     # txt 无空行分隔时，单条记录的最大行数
+BULK_LOG_KEEP = 500             # 大文件任务只保留最近的日志条数
+ACCOUNT_QUOTA_COOLDOWN = 3600    # 容量不足/登录失效的账号冷却时间 (秒)
+ACCOUNT_THROTTLE_COOLDOWN = 300  # 触发验证码/频率限制的账号冷却时间 (秒)
+BAIDU_ACCOUNT_BATCH = 20         # 多账号时每个百度账号单次领取的链接数
+PREFETCH_MAX_LINKS = 50          # 草稿预解析最多处理的链接数
+PREFETCH_DEBOUNCE = 5            # 同一用户相邻两轮草稿预解析的最小间隔 (秒)
+NOTIFY_OUTBOX_FILE = "notify_outbox.json"
+NOTIFY_COALESCE_SECONDS = 10   # 每条通知 (包括单独的一条) 都会延迟这么久发出，以便合并
+NOTIFY_BACKOFF_BASE = 5
+NOTIFY_MAX_ATTEMPTS = 6
+
+# ==========================================
+# 5. 核心：后台线程 Worker
+# ==========================================
+async def open_quark(job_id, quark_cookie, account=""):
+    """登录夸克并定位保存目录；成功返回 (engine, root_fid)，失败返回 (None, None)"""
+    if not quark_cookie:
+        job_manager.add_log(job_id, "夸克：未配置Cookie，跳过", "error")
+        return None, None
+    job_manager.add_log(job_id, "开始处理夸克链接...", "quark")
+    q_engine = QuarkEngine(quark_cookie, account)
+    session = account_sessions.get(("quark", cookie_key(quark_cookie)))
+    if session:
+        job_manager.add_log(job_id, f"登录成功: {session['user']} (已预热)", "success")
+        return q_engine, session['root_fid']
+    t0 = time.time()
+    with stage_span("quark", account, "login"):
+        user = await q_engine.check_login()
+    if not user:
+        job_manager.add_log(job_id, f"登录失败 (耗时: {get_time_diff(t0)})", "error")
+        await q_engine.close()
+        return None, None
+    job_manager.add_log(job_id, f"登录成功: {user} (耗时: {get_time_diff(t0)})", "success")
+    t_root = time.time()
+    with stage_span("quark", account, "root_dir"):
+        root_fid = await q_engine.get_folder_id(QUARK_SAVE_PATH)
+    if not root_fid:
+        job_manager.add_log(job_id, f"目录不存在，手动在夸克网盘中创建 来自：分享/LinkChanger文件夹 (耗时: {get_time_diff(t_root)})", "error")
+        await q_engine.close()
+        return None, None
+    account_sessions.put(("quark", cookie_key(quark_cookie)), {"user": user, "root_fid": root_fid})
+    return q_engine, root_fid
+
+def quark_source_url(link):
+    """提取码写在链接后面时，拼回 URL 供引擎解析"""
+    return link.url if URL_PWD_REGEX.search(link.url) or not link.pwd else f"{link.url}?pwd={link.pwd}"
+
+def describe_share(resolved):
+    return f" ({resolved['items']} 项, {format_size(resolved['size'])})" if resolved else ""
+
+async def preflight_links(job_id, numbered, quark_cookies, baidu_cookies, account="", record_dead=True):
+    """
+    预检：并发探测全部链接 (夸克 token+detail，百度 verify+share/list)，不转存；
+    dead_links / share_cache 中的链接直接使用缓存结果。job_id 为 None 时不记录日志与时间线 (草稿预解析)。
+    每次探测由 account_scheduler 分配账号，百度账号经 open_baidu 登录 (复用 account_sessions 中的 bdstoken)。
+    numbered: [(序号, ShareLink)]；返回 {link.start: (resolved, 错误信息)}。
+    record_dead=False 时不把失效结果写入 dead_links (草稿预解析只是推测性的探测)。
+    有错误信息表示链接已确认失效 (classify_dead_link)；两者均为 None 表示无法判断，交给后续流程按原方式处理。
+    """
+    checked = {}
+    slots = asyncio.Semaphore(PREFLIGHT_CONCURRENCY)
+    cookies = {"quark": quark_cookies, "baidu": baidu_cookies}
+    labels = {provider: account_labels(account, cookies[provider]) for provider in cookies}
+    engines = {}  # (provider, cookie) -> 引擎 Future，每个账号只打开一次，打开失败为 None
+
+    def engine(provider, cookie):
+        if (provider, cookie) not in engines:
+            if provider == "quark":
+                engines[(provider, cookie)] = asyncio.get_running_loop().create_future()
+                engines[(provider, cookie)].set_result(QuarkEngine(cookie, labels[provider][cookie]))
+            else:
+                engines[(provider, cookie)] = asyncio.ensure_future(
+                    asyncio.to_thread(open_baidu, None, cookie, labels[provider][cookie]))
+        return engines[(provider, cookie)]
+
+    async def run_probe(link, cookie):
+        eng = await engine(link.provider, cookie)
+        if not eng: return None, None
+        if link.provider == "quark": return await eng.resolve_share(quark_source_url(link))
+        return await asyncio.to_thread(eng.probe_share, link.url, link.pwd)
+
+    async def probe(link_no, link):
+        if job_manager.is_cancelled(job_id): return
+        cached = dead_links.get(link)
+        if cached:
+            checked[link.start] = (None, f"{cached} (缓存)")
+            return
+        resolved = share_cache.get(share_link_key(link))
+        if resolved:
+            checked[link.start] = (resolved, "")
+            return
+        trace_link(job_id, link_no, link.url)
+        async with slots:
+            if job_manager.is_cancelled(job_id): return
+            cookie = account_scheduler.pick(link.provider, cookies[link.provider])
+            try:
+                resolved, err = await run_probe(link, cookie)
+            finally:
+                account_scheduler.release(link.provider, cookie)
+        kind = classify_account_error(err)
+        if kind: account_scheduler.penalize(link.provider, cookie, kind)
+        if not resolved and not classify_dead_link(err): err = None  # 限流、登录失效等与链接无关
+        checked[link.start] = (resolved, err)
+        if resolved: share_cache.put(share_link_key(link), resolved)
+        if err and record_dead: dead_links.put(link, err)
+
+    try:
+        await asyncio.gather(*(probe(link_no, link) for link_no, link in numbered if cookies[link.provider]))
+    finally:
+        for (provider, _), opened in engines.items():
+            if provider == "quark" and opened.done() and opened.result(): await opened.result().close()
+    return checked
+
+async def warm_accounts(quark_cookies, baidu_cookies, account=""):
+    """逐个账号登录并定位保存目录，结果写入 account_sessions (已有有效登录态的账号跳过)"""
+    slots = asyncio.Semaphore(WARMUP_CONCURRENCY)
+    q_labels, b_labels = account_labels(account, quark_cookies), account_labels(account, baidu_cookies)
+
+    async def warm_quark(cookie):
+        if account_sessions.get(("quark", cookie_key(cookie))): return
+        async with slots:
+            q_engine, _ = await open_quark(None, cookie, q_labels[cookie])
+            if q_engine: await q_engine.close()
+
+    async def warm_baidu(cookie):
+        if account_sessions.get(("baidu", cookie_key(cookie))): return
+        async with slots:
+            await asyncio.to_thread(open_baidu, None, cookie, b_labels[cookie])
+
+    await asyncio.gather(*(warm_quark(c) for c in quark_cookies), *(warm_baidu(c) for c in baidu_cookies),
+                         return_exceptions=True)
+
+def prefetch_draft(input_text, quark_cookie, baidu_cookie, account=""):
+    """
+    草稿预解析 (在后台线程中调用，网页端经 draft_prefetcher 调度)：用户点击开始前先解析草稿中的链接并预热涉及的账号，
+    有效结果写入 share_cache / account_sessions，随后的任务直接从转存阶段开始；失效结果不记入 dead_links。
+    """
+    links = scan_share_links(input_text)[:PREFETCH_MAX_LINKS]
+    if not links: return
+    q_cookies = split_cookies(quark_cookie) if any(link.provider == "quark" for link in links) else []
+    b_cookies = split_cookies(baidu_cookie) if any(link.provider == "baidu" for link in links) else []
+
+    async def run():
+        await asyncio.gather(
+            preflight_links(None, list(enumerate(links, 1)), q_cookies, b_cookies, account, record_dead=False),
+            warm_accounts(q_cookies, b_cookies, account))
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        print(f"[Prefetch] 预解析失败: {e}")
+
+class DraftPrefetcher:
+    """
+    草稿预解析调度：每个用户最多一个后台线程。进行中再次提交只保留最新的草稿，
+    当前一轮结束后接着处理；相邻两轮至少间隔 PREFETCH_DEBOUNCE 秒，期间的多次提交合并为一轮。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}     # account -> (input_text, quark_cookie, baidu_cookie)，只保留最新一份
+        self.running = set()  # 有预解析线程的用户
+        self.last_start = {}  # account -> 上一轮开始时间
+
+    def submit(self, input_text, quark_cookie, baidu_cookie, account=""):
+        """登记草稿；该用户没有进行中的预解析时启动线程。返回是否新启动了线程"""
+        with self.lock:
+            self.pending[account] = (input_text, quark_cookie, baidu_cookie)
+            if account in self.running: return False
+            self.running.add(account)
+        threading.Thread(target=self._run, args=(account,), daemon=True).start()
+        return True
+
+    def _run(self, account):
+        while True:
+            with self.lock:
+                wait = self.last_start.get(account, 0) + PREFETCH_DEBOUNCE - time.time()
+            if wait > 0: time.sleep(wait)
+            with self.lock:
+                args = self.pending.pop(account, None)
+                if args is None:
+                    self.running.discard(account)
+                    return
+                self.last_start[account] = time.time()
+            prefetch_draft(*args, account)
+
+draft_prefetcher = DraftPrefetcher()
+
+async def convert_quark_link(job_id, q_engine, root_fid, link, link_no, step_prefix, image_config, account="", resolved=None):
+    """转存并重新分享单个夸克链接 (含广告植入；节流由流水线的阶段间隔负责)，返回 (新链接或 None, 消息)"""
+    raw_url = link.url
+    if job_manager.is_cancelled(job_id): return None, "已取消"
+    cached = dead_links.get(link)
+    if cached:
+        job_manager.add_log(job_id, f"{step_prefix} {cached} (缓存): {raw_url}", "error")
+        return None, cached
+    source_url = quark_source_url(link)
+    trace_link(job_id, link_no, raw_url)
+    job_manager.add_log(job_id, f"{step_prefix} 处理中: {raw_url}{describe_share(resolved)}", "quark")
+    
+    t_task = time.time()
+    with stage_span("quark", account, "link", kind="link") as span:
+        new_url, msg, new_fid = await q_engine.process_url(source_url, root_fid, resolved=resolved)
+        if not new_url: span.fail()
+    t_task_end = get_time_diff(t_task)
+    
+    if new_url:
+        log_msg = f"{step_prefix} 转存成功: {new_url} (耗时: {t_task_end})"
+        if image_config['quark']['enabled'] and new_fid:
+            t_img = time.time()
+            res_url, res_msg, _ = await q_engine.process_url(image_config['quark']['url'], new_fid, is_inject=True)
+            if res_url == "INJECT_OK": log_msg += f" + 植入(耗时:{get_time_diff(t_img)})"
+        job_manager.add_log(job_id, log_msg, "success")
+    else:
+        job_manager.add_log(job_id, f"{step_prefix} {msg} (耗时: {t_task_end})", "error")
+        dead_links.put(link, msg)
+        share_cache.drop(share_link_key(link))
+    return new_url, msg
+
+def open_baidu(job_id, baidu_cookie, account=""):
+    """登录百度并确保保存目录存在；成功返回 engine，失败返回 None"""
+    if not baidu_cookie:
+        job_manager.add_log(job_id, "百度：未配置Cookie，跳过", "error")
+        return None
+    job_manager.add_log(job_id, "开始处理百度链接...", "baidu")
+    b_engine = BaiduEngine(baidu_cookie, account)
+    session = account_sessions.get(("baidu", cookie_key(baidu_cookie)))
+    if session:
+        b_engine.bdstoken = session['bdstoken']
+        job_manager.add_log(job_id, "登录成功 (已预热)", "success")
+        return b_engine
+    t0 = time.time()
+    with stage_span("baidu", account, "login"):
+        token_ok = b_engine.init_token()
+    if not token_ok:
+        job_manager.add_log(job_id, f"登录失败 (耗时: {get_time_diff(t0)})", "error")
+        return None
+    job_manager.add_log(job_id, f"登录成功 (耗时: {get_time_diff(t0)})", "success")
+    with stage_span("baidu", account, "root_dir"):
+        if not b_engine.check_dir_exists(BAIDU_SAVE_PATH): b_engine.create_dir(BAIDU_SAVE_PATH)
+    account_sessions.put(("baidu", cookie_key(baidu_cookie)), {"bdstoken": b_engine.bdstoken})
+    return b_engine
+
+def provision_baidu_dirs(job_id, b_engine, folders, account=""):
+    """批量预建目标目录，移出单链接关键路径；返回 {path: api/create 结果}"""
+    t_dir = time.time()
+    with stage_span("baidu", account, "provision"):
+        provisioned = b_engine.provision_dirs([f"{BAIDU_SAVE_PATH}/{folder}" for folder in folders])
+    job_manager.add_log(job_id, f"预建目录 {sum(1 for v in provisioned.values() if v)}/{len(folders)} (耗时: {get_time_diff(t_dir)})", "info")
+    return provisioned
+
+def discard_baidu_dirs(job_id, b_engine, folders, provisioned, account=""):
+    """删除预建后没有用上的目录 (链接失败、交还队列等)，避免在保存目录下留下空文件夹"""
+    paths = []
+    for folder in folders:
+        key = f"{BAIDU_SAVE_PATH}/{folder}"
+        created = provisioned.pop(key, None)
+        if created: paths.append(created.get('path') or key)
+    if not paths: return
+    try:
+        with stage_span("baidu", account, "discard"):
+            b_engine.delete_paths(paths)
+    except Exception as e:
+        job_manager.add_log(job_id, f"清理预建目录失败: {e}", "error")
+
+def convert_baidu_link(job_id, b_engine, link, folder, provisioned, link_no, step_prefix, image_config, account="", resolved=None):
+    """转存并重新分享单个百度链接 (含广告植入与节流等待)，返回 (新链接或 None, 消息)"""
+    raw_url = link.url
+    if job_manager.is_cancelled(job_id):
+        discard_baidu_dirs(job_id, b_engine, [folder], provisioned, account)
+        return None, "已取消"
+    cached = dead_links.get(link)
+    if cached:
+        job_manager.add_log(job_id, f"{step_prefix} {cached} (缓存): {raw_url}", "error")
+        discard_baidu_dirs(job_id, b_engine, [folder], provisioned, account)
+        return None, cached
+    trace_link(job_id, link_no, raw_url)
+    job_manager.add_log(job_id, f"{step_prefix} 处理中: {raw_url}{describe_share(resolved)}", "baidu")
+    
+    t_task = time.time()
+    url_info = {'url': raw_url, 'pwd': link.pwd, 'folder': folder, 'resolved': resolved,
+                'dir': provisioned.get(f"{BAIDU_SAVE_PATH}/{folder}")}
+    with stage_span("baidu", account, "link", kind="link") as span:
+        new_url, msg, new_dir_path = b_engine.process_url(url_info, BAIDU_SAVE_PATH)
+        if not new_url: span.fail()
+    t_task_end = get_time_diff(t_task)
+    
+    if new_url:
+        log_msg = f"{step_prefix} 转存成功: {new_url} (耗时: {t_task_end})"
+        if image_config['baidu']['enabled'] and new_dir_path:
+            t_img = time.time()
+            img_res_url, img_msg, _ = b_engine.process_url({'url': image_config['baidu']['url'], 'pwd': image_config['baidu']['pwd']}, new_dir_path, is_inject=True)
+            if img_res_url == "INJECT_OK": log_msg += f" + 植入(耗时:{get_time_diff(t_img)})"
+        job_manager.add_log(job_id, log_msg, "success")
+    else:
+        job_manager.add_log(job_id, f"{step_prefix} {msg} (耗时: {t_task_end})", "error")
+        dead_links.put(link, msg)
+        share_cache.drop(share_link_key(link))
+        # "✅ 已存入网盘 (...)" 表示文件已转存、只是分享失败，目录保留
+        if not msg.startswith("✅"):
+            discard_baidu_dirs(job_id, b_engine, [folder], provisioned, account)
+
+    if not job_manager.is_cancelled(job_id):
+        with stage_span("baidu", account, "pacing", kind="sleep"):
+            time.sleep(random.uniform(2, 4))
+    return new_url, msg
+
+def finish_job(job_id, start_time, final_text, success_count, total_tasks, bark_key, pushdeer_key, result_file=None, account="", **extra):
+    duration_obj = datetime.now() - start_time
+    duration_str = str(duration_obj)[:-4] if len(str(duration_obj)) > 4 else str(duration_obj)
+    cancelled = job_manager.is_cancelled(job_id)
+    summary = {"success": success_count, "total": total_tasks, "duration": str(duration_obj), **extra}
+    if cancelled:
+        summary["cancelled"] = True
+        job_manager.add_log(job_id, f"⏹ 任务已取消：成功 {success_count}/{total_tasks}，未处理的链接保持原样", "error")
+    job_manager.complete_job(job_id, final_text, summary, result_file)
+    
+    if bark_key or pushdeer_key:
+        body_msg = f"成功: {success_count}/{total_tasks} | 耗时: {duration_str}"
+        title_msg = "⏹ 转存已取消" if cancelled else "✅ 转存完成" if success_count > 0 else "❌ 转存结束(无成功)"
+        send_notification(bark_key, pushdeer_key, title_msg, body_msg, account)
+
+def worker_thread(job_id, input_text, quark_cookie, baidu_cookie, bark_key, pushdeer_key, image_config, account="", concurrency=None):
+    """
+    quark_cookie / baidu_cookie 可以是多个账号 (见 split_cookies)，链接由 account_scheduler 分配。
+    转存前先并发预检全部链接 (preflight_links)，失效链接直接记为失败，不占用账号与节流等待。
+    任务被取消 (job_manager.cancel_job) 后不再领取新链接，进行中的链接在下一个阶段边界停止，已转换的部分照常输出。
+    concurrency: 每个账号同时处理的链接数。未指定时夸克按流水线容量 (QUARK_INFLIGHT_PER_ACCOUNT) 送入链接，
+    由各阶段的并发与间隔限速；百度为 1 (与原先逐条处理一致)。
+    百度每个账号开 concurrency 个线程 (通道)，共用一个已登录的引擎：分享级 BDCLND 只叠加在单次请求上，互不干扰。
+    """
+    q_cookies = split_cookies(quark_cookie)
+    b_cookies = split_cookies(baidu_cookie)
+    
+    async def async_worker():
+        start_time = datetime.now()
+        final_text = input_text
+        success_count = 0
+        current_idx = 0
+        
+        links = scan_share_links(input_text)
+        q_matches = [link for link in links if link.provider == "quark"]
+        b_matches = [link for link in links if link.provider == "baidu"]
+        total_tasks = len(q_matches) + len(b_matches)
+        
+        job_manager.update_progress(job_id, 0, total_tasks)
+        trace_link(job_id)
+        q_opened = {}  # cookie -> Future[(engine, root_fid)]
+
+        try:
+            # --- 预检 ---
+            numbered = list(enumerate(q_matches + b_matches, 1))
+            checked = {}
+            if (q_matches and q_cookies) or (b_matches and b_cookies):
+                t_check = time.time()
+                checked = await preflight_links(job_id, numbered, q_cookies, b_cookies, account)
+                trace_link(job_id)
+                live = [resolved for resolved, err in checked.values() if resolved]
+                dead = 0
+                for link_no, link in numbered:
+                    err = checked.get(link.start, (None, None))[1]
+                    if not err: continue
+                    dead += 1
+                    job_manager.add_log(job_id, f"[{link_no}/{total_tasks}] 预检失效: {err} {link.url}", "error")
+                current_idx += dead
+                job_manager.update_progress(job_id, current_idx, total_tasks)
+                job_manager.add_log(job_id, f"预检完成: 有效 {len(live)} 个 ({sum(r['items'] for r in live)} 项, "
+                                            f"{format_size(sum(r['size'] for r in live))})，失效 {dead} 个，"
+                                            f"未确认 {len(checked) - len(live) - dead} 个 (耗时: {get_time_diff(t_check)})", "info")
+            q_live = [(i, link) for i, link in numbered[:len(q_matches)] if not checked.get(link.start, (None, None))[1]]
+            b_live = [(i, link) for i, link in numbered[len(q_matches):] if not checked.get(link.start, (None, None))[1]]
+
+            # --- 夸克 ---
+            if q_matches:
+                if not q_cookies:
+                    job_manager.add_log(job_id, "夸克：未配置Cookie，跳过", "error")
+                elif q_live:
+                    q_labels = account_labels(account, q_cookies)
+                    if len(q_cookies) > 1:
+                        job_manager.add_log(job_id, f"夸克：{len(q_cookies)} 个账号分担 {len(q_live)} 个链接", "quark")
+                    quark_slots = asyncio.Semaphore(max(1, concurrency or QUARK_INFLIGHT_PER_ACCOUNT) * len(q_cookies))
+                    q_skipped = 0
+
+                    async def run_quark_link(link_no, link):
+                        nonlocal final_text, success_count, current_idx, q_skipped
+                        step_prefix = f"[{link_no}/{total_tasks}]"
+                        async with quark_slots:
+                            if job_manager.is_cancelled(job_id):
+                                q_skipped += 1
+                                return
+                            current_idx += 1
+                            job_manager.update_progress(job_id, current_idx, total_tasks)
+                            tried = set()
+                            while True:
+                                cookie = account_scheduler.pick("quark", q_cookies, tried)
+                                if cookie is None:
+                                    job_manager.add_log(job_id, f"{step_prefix} 无可用的夸克账号: {link.url}", "error")
+                                    return
+                                tried.add(cookie)
+                                try:
+                                    if cookie not in q_opened:
+                                        q_opened[cookie] = asyncio.ensure_future(open_quark(job_id, cookie, q_labels[cookie]))
+                                    q_engine, root_fid = await q_opened[cookie]
+                                    if not q_engine:
+                                        account_scheduler.penalize("quark", cookie, "quota")
+                                        continue
+                                    new_url, msg = await convert_quark_link(job_id, q_engine, root_fid, link, link_no,
+                                                                            step_prefix, image_config, q_labels[cookie],
+                                                                            checked.get(link.start, (None, None))[0])
+                                finally:
+                                    account_scheduler.release("quark", cookie)
+                                if new_url:
+                                    final_text = final_text.replace(link.url, new_url)
+                                    success_count += 1
+                                    return
+                                kind = classify_account_error(msg)
+                                if not kind or job_manager.is_cancelled(job_id): return
+                                account_scheduler.penalize("quark", cookie, kind)
+                                if len(tried) >= len(q_cookies): return
+                                job_manager.add_log(job_id, f"{step_prefix} 账号 {q_labels[cookie]} 受限，换账号重试", "quark")
+
+                    await asyncio.gather(*(run_quark_link(i, link) for i, link in q_live))
+                    if q_skipped:
+                        job_manager.add_log(job_id, f"夸克：已取消，跳过 {q_skipped} 个未处理的链接", "quark")
+
+            # --- 百度 ---
+            if b_matches:
+                if not b_cookies:
+                    job_manager.add_log(job_id, "百度：未配置Cookie，跳过", "error")
+                elif b_live and job_manager.is_cancelled(job_id):
+                    job_manager.add_log(job_id, f"百度：已取消，跳过 {len(b_live)} 个未处理的链接", "baidu")
+                elif b_live:
+                    b_labels = account_labels(account, b_cookies)
+                    folder_index = FolderNameIndex(input_text)
+                    folders = plan_folder_names([folder_index.name_at(link.start) for _, link in b_live], job_id[:4])
+                    queue = deque((i, link, folder) for (i, link), folder in zip(b_live, folders))
+                    lock = threading.Lock()
+                    accounts = account_scheduler.rank("baidu", b_cookies)
+                    if len(accounts) > 1:
+                        job_manager.add_log(job_id, f"百度：{len(accounts)} 个账号分担 {len(b_live)} 个链接", "baidu")
+                    with ThreadPoolExecutor(max_workers=len(accounts)) as pool:
+                        # 每个线程复制当前上下文，阶段耗时仍记入本任务的时间线
+                        engines = list(pool.map(lambda c: contextvars.copy_context().run(open_baidu, job_id, c, b_labels[c]), accounts))
+                    for cookie, b_engine in zip(accounts, engines):
+                        if not b_engine: account_scheduler.penalize("baidu", cookie, "quota")
+                    lane_count = max(1, concurrency or 1)
+                    lanes = [(c, e) for c, e in zip(accounts, engines) if e for _ in range(lane_count)]
+                    active = {c: lane_count for c, e in zip(accounts, engines) if e}  # 账号 -> 仍在运行的通道数
+                    stopped = set()  # 本任务中已受限、不再领取链接的账号
+
+                    def others_available(cookie):
+                        return any(n > 0 and c != cookie and c not in stopped for c, n in active.items())
+
+                    def run_baidu_lane(cookie, b_engine):
+                        """百度账号的一条通道：按批领取链接、批量预建目录后顺序处理；账号受限时把剩余链接交还队列"""
+                        nonlocal final_text, success_count, current_idx
+                        label = b_labels[cookie]
+                        account_scheduler.acquire("baidu", cookie)
+                        try:
+                            while True:
+                                with lock:
+                                    if not queue or cookie in stopped or job_manager.is_cancelled(job_id): return
+                                    lanes_left = sum(active.values())
+                                    take = len(queue) if lanes_left == 1 else min(BAIDU_ACCOUNT_BATCH, math.ceil(len(queue) / lanes_left))
+                                    batch = [queue.popleft() for _ in range(take)]
+                                provisioned = provision_baidu_dirs(job_id, b_engine, [folder for _, _, folder in batch], label)
+                                for pos, (link_no, link, folder) in enumerate(batch):
+                                    with lock:
+                                        # 任务已取消，或同账号的其他通道已触发受限：本批剩余链接交还队列
+                                        handed_back = job_manager.is_cancelled(job_id) or (cookie in stopped and others_available(cookie))
+                                        if handed_back:
+                                            queue.extendleft(reversed(batch[pos:]))
+                                        else:
+                                            current_idx += 1
+                                            job_manager.update_progress(job_id, current_idx, total_tasks)
+                                    if handed_back:
+                                        discard_baidu_dirs(job_id, b_engine, [f for _, _, f in batch[pos:]], provisioned, label)
+                                        return
+                                    new_url, msg = convert_baidu_link(job_id, b_engine, link, folder, provisioned, link_no,
+                                                                      f"[{link_no}/{total_tasks}]", image_config, label,
+                                                                      checked.get(link.start, (None, None))[0])
+                                    if new_url:
+                                        with lock:
+                                            final_text = final_text.replace(link.url, new_url)
+                                            success_count += 1
+                                        continue
+                                    kind = classify_account_error(msg)
+                                    with lock:
+                                        requeue = bool(kind) and others_available(cookie)
+                                        if requeue:
+                                            # 当前链接连同本批剩余链接交还队列，由其他账号重试
+                                            stopped.add(cookie)
+                                            queue.extendleft(reversed(batch[pos:]))
+                                            current_idx -= 1
+                                    if requeue:
+                                        discard_baidu_dirs(job_id, b_engine, [f for _, _, f in batch[pos + 1:]], provisioned, label)
+                                        account_scheduler.penalize("baidu", cookie, kind)
+                                        job_manager.add_log(job_id, f"账号 {label} 受限，剩余 {len(batch) - pos} 个链接交给其他账号", "baidu")
+                                        return
+                        finally:
+                            with lock: active[cookie] -= 1
+                            account_scheduler.release("baidu", cookie)
+
+                    if lanes:
+                        with ThreadPoolExecutor(max_workers=len(lanes)) as pool:
+                            list(pool.map(lambda lane: contextvars.copy_context().run(run_baidu_lane, *lane), lanes))
+                    if queue and job_manager.is_cancelled(job_id):
+                        job_manager.add_log(job_id, f"百度：已取消，跳过 {len(queue)} 个未处理的链接", "baidu")
+                    else:
+                        for link_no, link, _ in queue:
+                            job_manager.add_log(job_id, f"[{link_no}/{total_tasks}] 无可用的百度账号: {link.url}", "error")
+
+        finally:
+            for opened in q_opened.values():
+                if opened.done() and not opened.cancelled() and not opened.exception() and opened.result()[0]:
+                    await opened.result()[0].close()
+            finish_job(job_id, start_time, final_text, success_count, total_tasks, bark_key, pushdeer_key,
+                       account=account)
+
+    asyncio.run(async_worker())
+
+# ==========================================
+# 5.1 大文件流式处理
+# ==========================================
+BULK_FORMATS = ("txt", "csv", "jsonl")
+
+def bulk_format(filename):
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    return ext if ext in BULK_FORMATS else "txt"
+
+def bulk_paths(job_id, filename):
+    """上传文件与结果文件在 BULK_DIR 中的路径"""
+    os.makedirs(BULK_DIR, exist_ok=True)
+    ext = bulk_format(filename)
+    return os.path.join(BULK_DIR, f"{job_id}.in.{ext}"), os.path.join(BULK_DIR, f"{job_id}.out.{ext}")
+
+def _iter_text_blocks(lines):
+    """按空行切分帖子，单块最多 BULK_RECORD_MAX_LINES 行"""
+    block = []
+    for line in lines:
+        block.append(line)
+        if not line.strip() or len(block) >= BULK_RECORD_MAX_LINES:
+            yield "".join(block)
+            block = []
+    if block: yield "".join(block)
+
+def _json_strings(obj):
+    if isinstance(obj, str): yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values(): yield from _json_strings(v)
+    elif isinstance(obj, list):
+        for v in obj: yield from _json_strings(v)
+
+def _json_map_strings(obj, func):
+    if isinstance(obj, str): return func(obj)
+    if isinstance(obj, dict): return {k: _json_map_strings(v, func) for k, v in obj.items()}
+    if isinstance(obj, list): return [_json_map_strings(v, func) for v in obj]
+    return obj
+
+def iter_bulk_records(lines, fmt):
+    """
+    产出 (texts, render)：texts 为记录中的文本片段，render(new_texts) 返回写回文件的内容。
+    txt 以空行分隔的帖子为记录，csv 以行为记录，jsonl 以每行 JSON 为记录 (只改写字符串值)。
+    """
+    if fmt == "csv":
+        for row in csv.reader(lines):
+            def render(cells):
+                out = io.StringIO()
+                csv.writer(out, lineterminator="\n").writerow(cells)
+                return out.getvalue()
+            yield row, render
+    elif fmt == "jsonl":
+        for line in lines:
+            try:
+                obj = json.loads(line) if line.strip() else None
+            except ValueError:
+                obj = None
+            if obj is None or isinstance(obj, str):
+                yield [line], lambda texts: texts[0]
+                continue
+            texts = list(_json_strings(obj))
+            def render(new_texts, obj=obj):
+                replaced = iter(new_texts)
+                return json.dumps(_json_map_strings(obj, lambda _: next(replaced)), ensure_ascii=False) + "\n"
+            yield texts, render
+    else:
+        for block in _iter_text_blocks(lines):
+            yield [block], lambda texts: texts[0]
+
+def bulk_worker_thread(job_id, in_path, out_path, quark_cookie, baidu_cookie, bark_key, pushdeer_key, image_config, account=""):
+    """
+    逐条读取大文件、逐条改写并立即写入结果文件，内存占用与文件大小无关。
+    进度以已读取字节数计；引擎在首次遇到对应网盘链接时才登录。
+    多账号时每个网盘同一时刻使用一个账号，受限后切换到负载最低的下一个账号。
+    """
+    fmt = bulk_format(in_path)
+    total_bytes = os.path.getsize(in_path)
+    q_cookies = split_cookies(quark_cookie)
+    b_cookies = split_cookies(baidu_cookie)
+    q_labels = account_labels(account, q_cookies)
+    b_labels = account_labels(account, b_cookies)
+
+    async def async_worker():
+        start_time = datetime.now()
+        success_count = link_count = record_count = 0
+        read_bytes = 0
+        # (cookie, engine, ...)；None 表示需要登录，False 表示已无可用账号
+        quark = baidu = None
+        q_spent, b_spent = set(), set()
+        folder_seen = {}
+        trace_link(job_id)
+
+        async def next_quark():
+            if not q_cookies:
+                job_manager.add_log(job_id, "夸克：未配置Cookie，跳过", "error")
+            for cookie in account_scheduler.rank("quark", q_cookies, q_spent):
+                q_spent.add(cookie)
+                q_engine, root_fid = await open_quark(job_id, cookie, q_labels[cookie])
+                if q_engine:
+                    account_scheduler.acquire("quark", cookie)
+                    return cookie, q_engine, root_fid
+                account_scheduler.penalize("quark", cookie, "quota")
+            return False
+
+        def next_baidu():
+            if not b_cookies:
+                job_manager.add_log(job_id, "百度：未配置Cookie，跳过", "error")
+            for cookie in account_scheduler.rank("baidu", b_cookies, b_spent):
+                b_spent.add(cookie)
+                b_engine = open_baidu(job_id, cookie, b_labels[cookie])
+                if b_engine:
+                    account_scheduler.acquire("baidu", cookie)
+                    return cookie, b_engine
+                account_scheduler.penalize("baidu", cookie, "quota")
+            return False
+
+        def counted(fin):
+            nonlocal read_bytes
+            for line in fin:
+                read_bytes += len(line.encode("utf-8"))
+                yield line
+
+        try:
+            with open(in_path, encoding="utf-8", errors="replace", newline="") as fin, \
+                 open(out_path, "w", encoding="utf-8", newline="") as fout:
+                for texts, render in iter_bulk_records(counted(fin), fmt):
+                    record_count += 1
+                    # 片段用换行拼接，保证标题识别与提取码窗口不跨片段串位
+                    joined = "\n".join(texts)
+                    links = scan_share_links(joined)
+                    replacements = {}
+                    if job_manager.is_cancelled(job_id):
+                        # 已取消：剩余记录原样写出，结果文件保持完整
+                        link_count += len(links)
+                        fout.write(render(texts))
+                        job_manager.update_progress(job_id, read_bytes, total_bytes)
+                        continue
+
+                    for link in (link for link in links if link.provider == "quark"):
+                        link_count += 1
+                        if quark is None: quark = await next_quark()
+                        if not quark: continue
+                        cookie, q_engine, root_fid = quark
+                        new_url, msg = await convert_quark_link(job_id, q_engine, root_fid, link, link_count,
+                                                                f"[#{link_count}]", image_config, q_labels[cookie])
+                        if new_url:
+                            replacements[link.url] = new_url
+                            success_count += 1
+                        elif classify_account_error(msg) and len(q_spent) < len(q_cookies):
+                            account_scheduler.penalize("quark", cookie, classify_account_error(msg))
+                            account_scheduler.release("quark", cookie)
+                            await q_engine.close()
+                            quark = None
+
+                    b_links = [link for link in links if link.provider == "baidu"]
+                    if b_links and baidu is None:
+                        baidu = next_baidu()
+                    if b_links and baidu:
+                        cookie, b_engine = baidu
+                        folder_index = FolderNameIndex(joined)
+                        folders = plan_folder_names([folder_index.name_at(link.start) for link in b_links], job_id[:4], folder_seen)
+                        provisioned = provision_baidu_dirs(job_id, b_engine, folders, b_labels[cookie])
+                        for link, folder in zip(b_links, folders):
+                            link_count += 1
+                            new_url, msg = convert_baidu_link(job_id, b_engine, link, folder, provisioned, link_count,
+                                                              f"[#{link_count}]", image_config, b_labels[cookie])
+                            if new_url:
+                                replacements[link.url] = new_url
+                                success_count += 1
+                            elif classify_account_error(msg) and len(b_spent) < len(b_cookies):
+                                # 本条记录剩余链接仍用当前账号，下一条记录起换账号
+                                account_scheduler.penalize("baidu", cookie, classify_account_error(msg))
+                                baidu = None
+                        if baidu is None: account_scheduler.release("baidu", cookie)
+                    else:
+                        link_count += len(b_links)
+
+                    new_texts = texts
+                    if replacements:
+                        new_texts = []
+                        for text in texts:
+                            for raw_url, new_url in replacements.items():
+                                text = text.replace(raw_url, new_url)
+                            new_texts.append(text)
+                    fout.write(render(new_texts))
+                    fout.flush()
+                    job_manager.update_progress(job_id, read_bytes, total_bytes)
+        except Exception as e:
+            job_manager.add_log(job_id, f"文件处理中断: {e}", "error")
+        finally:
+            if quark:
+                account_scheduler.release("quark", quark[0])
+                await quark[1].close()
+            if baidu: account_scheduler.release("baidu", baidu[0])
+            finish_job(job_id, start_time, "", success_count, link_count, bark_key, pushdeer_key,
+                       result_file=out_path, account=account, records=record_count)
+
+    asyncio.run(async_worker())
+
+# ==========================================
+# 5.2 后台服务：通知发件箱
+# ==========================================
+class NotificationDispatcher:
+    """
+    持久化发件箱 (NOTIFY_OUTBOX_FILE)：任务结束只负责入队。
+    发件箱只记录收件人 (uid) 与渠道名，Bark / PushDeer key 不落盘：入队时的 key 只保存在内存，
+    进程重启后通过 key_resolver(uid) (由网页端设置为读取 secrets) 重新查找，查不到的渠道丢弃。
+    后台线程把同一收件人的通知延迟 NOTIFY_COALESCE_SECONDS 秒后合并为一条 (只有一条时也会等待)，
+    并发发送，失败的渠道按指数退避重试，超过 NOTIFY_MAX_ATTEMPTS 次丢弃。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.keys = {}            # (recipient, channel) -> key，仅在内存中
+        self.key_resolver = None  # uid -> {"bark": ..., "pushdeer": ...}
+        self.outbox = self._load()
+        self.thread = None
+
+    def start(self):
+        if self.thread: return
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _recipient(uid, bark_key, pushdeer_key):
+        # 没有 uid 时 (如直接传入 key) 用 key 的摘要区分收件人，同样不落明文
+        return uid or f"key:{cookie_key(f'{bark_key}|{pushdeer_key}')}"
+
+    def _key(self, recipient, channel):
+        key = self.keys.get((recipient, channel))
+        if key or not self.key_resolver or recipient.startswith("key:"): return key
+        try:
+            key = (self.key_resolver(recipient) or {}).get(channel, "")
+        except Exception:
+            key = ""
+        if key: self.keys[(recipient, channel)] = key
+        return key
+
+    def enqueue(self, bark_key, pushdeer_key, title, body, uid=""):
+        channels = [c for c, key in (("bark", bark_key), ("pushdeer", pushdeer_key)) if key]
+        if not channels: return
+        recipient = self._recipient(uid, bark_key, pushdeer_key)
+        with self.lock:
+            for channel, key in (("bark", bark_key), ("pushdeer", pushdeer_key)):
+                if key: self.keys[(recipient, channel)] = key
+            # 同一收件人尚未发出的消息共用第一条的发送时间，便于合并
+            next_try = next((m["next_try"] for m in self.outbox
+                             if m["attempts"] == 0 and m["recipient"] == recipient),
+                            time.time() + NOTIFY_COALESCE_SECONDS)
+            self.outbox.append({
+                "id": str(uuid.uuid4())[:8], "recipient": recipient,
+                "title": title, "body": body, "channels": channels,
+                "attempts": 0, "created_at": time.time(), "next_try": next_try
+            })
+            self._save()
+        self.start()
+        self.wakeup.set()
+
+    def _load(self):
+        try:
+            with open(NOTIFY_OUTBOX_FILE, "r", encoding="utf-8") as f:
+                outbox = json.load(f)
+        except (OSError, ValueError):
+            return []
+        for msg in outbox:
+            if "recipient" not in msg:
+                # 旧版发件箱直接保存了 key：迁入内存，下次写盘时去掉
+                bark_key, pushdeer_key = msg.pop("bark", ""), msg.pop("pushdeer", "")
+                msg["recipient"] = self._recipient("", bark_key, pushdeer_key)
+                for channel, key in (("bark", bark_key), ("pushdeer", pushdeer_key)):
+                    if key: self.keys[(msg["recipient"], channel)] = key
+        return outbox
+
+    def _save(self):
+        tmp_file = NOTIFY_OUTBOX_FILE + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.outbox, f, ensure_ascii=False)
+            os.replace(tmp_file, NOTIFY_OUTBOX_FILE)
+        except OSError as e:
+            print(f"[Notify] 发件箱写入失败: {e}")
+
+    def _take_due(self):
+        """取出到期消息；首次发送的同收件人消息合并为一条"""
+        now = time.time()
+        with self.lock:
+            due = [m for m in self.outbox if m["next_try"] <= now]
+            if not due: return []
+            self.outbox = [m for m in self.outbox if m["next_try"] > now]
+
+        fresh, retries = {}, []
+        for msg in due:
+            if msg["attempts"] == 0:
+                fresh.setdefault(msg["recipient"], []).append(msg)
+            else:
+                retries.append(msg)
+        for group in fresh.values():
+            if len(group) == 1:
+                retries.append(group[0])
+                continue
+            merged = dict(group[0])
+            merged["title"] = f"📦 {len(group)} 个转存任务已结束"
+            merged["body"] = "\n".join(f"{m['title']} {m['body']}" for m in group)
+            merged["channels"] = sorted({c for m in group for c in m["channels"]})
+            retries.append(merged)
+        return retries
+
+    def _loop(self):
+        while True:
+            batch = self._take_due()
+            if batch:
+                try:
+                    asyncio.run(self._dispatch(batch))
+                except Exception as e:
+                    print(f"[Notify] 发送异常: {e}")
+                    for msg in batch:
+                        msg["attempts"] += 1
+                        msg["next_try"] = time.time() + min(NOTIFY_BACKOFF_BASE * 2 ** msg["attempts"], 600)
+                with self.lock:
+                    self.outbox.extend(m for m in batch if m["channels"] and m["attempts"] < NOTIFY_MAX_ATTEMPTS)
+                    self._save()
+            with self.lock:
+                next_try = min((m["next_try"] for m in self.outbox), default=None)
+            self.wakeup.wait(None if next_try is None else max(0.1, next_try - time.time()))
+            self.wakeup.clear()
+
+    async def _dispatch(self, batch):
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            async def send(msg, channel):
+                key = self._key(msg["recipient"], channel)
+                if not key: return None  # 找不到 key (如重启后用户已删除)：丢弃该渠道
+                try:
+                    if channel == "bark":
+                        url = f"https://api.day.app/{key}/{quote(msg['title'])}/{quote(msg['body'])}"
+                        r = await client.get(url, params={"icon": "https://cdn-icons-png.flaticon.com/512/2991/2991110.png"})
+                    else:
+                        params = {"pushkey": key, "text": msg["title"], "desp": msg["body"], "type": "markdown"}
+                        r = await client.get("https://api2.pushdeer.com/message/push", params=params)
+                    return r.status_code < 400
+                except Exception:
+                    return False
+
+            jobs = [(msg, channel) for msg in batch for channel in msg["channels"]]
+            results = await asyncio.gather(*(send(msg, channel) for msg, channel in jobs))
+        failed = {}
+        for (msg, channel), ok in zip(jobs, results):
+            if ok is False: failed.setdefault(msg["id"], []).append(channel)
+        for msg in batch:
+            msg["channels"] = failed.get(msg["id"], [])
+            if msg["channels"]:
+                msg["attempts"] += 1
+                msg["next_try"] = time.time() + min(NOTIFY_BACKOFF_BASE * 2 ** msg["attempts"], 600)
+
+notifier = NotificationDispatcher()
+
@@ -1,73 +1,92 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import httpx
-import requests
 import asyncio
 import re
 import time
-import random
-import string
 import json
 import threading
-import uuid
+import os
 import html
-from urllib.parse import quote
+import shutil
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
 from datetime import datetime, timedelta, timezone
-from typing import Union, List, Any
-from retrying import retry
 # 引入 Cookie 管理器
 import extra_streamlit_components as stx
+# 引擎、流水线与后台服务 (不依赖 Streamlit，CLI 共用)
+from linkcore import (
+    QuarkEngine, BaiduEngine, job_manager, metrics, notifier, stage_span, worker_thread,
+    bulk_worker_thread, draft_prefetcher, warm_accounts, bulk_paths, BULK_FORMATS, split_cookies, account_labels, cookie_key,
+    smart_shorten_url, compute_critical_path, summarize_timeline, format_size,
+    QUARK_SAVE_PATH, BAIDU_SAVE_PATH, HEALTH_CHECK_CONCURRENCY, ACCOUNT_SESSION_TTL
+)
 
 # ==========================================
 # 0. 核心配置与全局对象
 # ==========================================
-
-# 全局任务管理器 (多用户共用一个管理器是安全的，只要 job_id 不冲突)
-@st.cache_resource
-class JobManager:
-    def __init__(self):
-        self.jobs = {} 
-
-    def _cleanup_old_jobs(self):
-        now = datetime.now()
-        expired_ids = [jid for jid, job in self.jobs.items() 
-                       if (now - job['created_at']).total_seconds() > 86400]
-        for jid in expired_ids:
-            del self.jobs[jid]
-
-    def create_job(self):
-        self._cleanup_old_jobs()
-        job_id = str(uuid.uuid4())[:8]
-        self.jobs[job_id] = {
-            "status": "running",
-            "logs": [],
-            "result_text": "",
-            "progress": {"current": 0, "total": 0},
-            "created_at": datetime.now(),
-            "summary": {}
+def get_secret(section, key, default=""):
+    try:
+        if section in st.secrets:
+            return st.secrets[section].get(key, default)
+        flat_key = f"{section}_{key}".upper()
+        if flat_key in st.secrets:
+            return st.secrets[flat_key]
+    except: pass
+    return default
+
+def get_configured_users():
+    """读取 st.secrets["users"] 中的全部账号配置 {uid: conf}"""
+    try:
+        if "users" in st.secrets:
+            return {uid: dict(conf) for uid, conf in st.secrets["users"].items()}
+    except: pass
+    return {}
+
+def build_image_config(user_conf):
+    """根据用户配置构建植入图片参数"""
+    q_img_url = user_conf.get("q_img", "")
+    b_img_url = user_conf.get("b_img", "")
+    return {
+        "quark": {
+            "url": q_img_url,
+            "enabled": bool(q_img_url and q_img_url.strip())
+        },
+        "baidu": {
+            "url": b_img_url,
+            "pwd": user_conf.get("b_pwd", ""),
+            "name": "公众号关注.jpg",
+            "enabled": bool(b_img_url and b_img_url.strip())
         }
-        return job_id
-
-    def get_job(self, job_id):
-        return self.jobs.get(job_id)
-
-    def add_log(self, job_id, message, type="info"):
-        if job_id in self.jobs:
-            timestamp = (datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%H:%M:%S")
-            safe_message = html.escape(message)
-            self.jobs[job_id]["logs"].append({"time": timestamp, "msg": safe_message, "type": type})
-
-    def update_progress(self, job_id, current, total):
-        if job_id in self.jobs:
-            self.jobs[job_id]["progress"] = {"current": current, "total": total}
-
-    def complete_job(self, job_id, final_text, summary):
-        if job_id in self.jobs:
-            self.jobs[job_id]["status"] = "done"
-            self.jobs[job_id]["result_text"] = final_text
-            self.jobs[job_id]["summary"] = summary
+    }
 
-job_manager = JobManager()
+def start_job(uid, user_conf, input_text):
+    """网页与本地 API 共用的任务入口：创建任务并启动后台线程，返回 job_id"""
+    job_id = job_manager.create_job(owner=uid)
+    t = threading.Thread(target=worker_thread, args=(
+        job_id, input_text, user_conf.get("q", ""), user_conf.get("b", ""),
+        user_conf.get("bark", ""), user_conf.get("pushdeer", ""), build_image_config(user_conf), uid))
+    t.start()
+    return job_id
+
+def start_bulk_job(uid, user_conf, upload, filename):
+    """大文件任务：上传内容分块落盘后由后台线程流式处理，返回 job_id"""
+    job_id = job_manager.create_job(bulk=True, owner=uid)
+    in_path, out_path = bulk_paths(job_id, filename)
+    with open(in_path, "wb") as f:
+        shutil.copyfileobj(upload, f, 1024 * 1024)
+    job_manager.attach_files(job_id, in_path, out_path)
+    t = threading.Thread(target=bulk_worker_thread, args=(
+        job_id, in_path, out_path, user_conf.get("q", ""), user_conf.get("b", ""),
+        user_conf.get("bark", ""), user_conf.get("pushdeer", ""), build_image_config(user_conf), uid))
+    t.start()
+    return job_id
+
+def prefetch_input(uid, user_conf):
+    """草稿提交 (失焦 / Ctrl+Enter) 时在后台预解析链接，点击开始后直接复用解析结果与登录态"""
+    text = st.session_state.get("link_input", "")
+    if not text.strip() or text == st.session_state.get("prefetched_text"): return
+    st.session_state["prefetched_text"] = text
+    draft_prefetcher.submit(text, user_conf.get("q", ""), user_conf.get("b", ""), uid)
 
 # ==========================================
 # 1. 页面配置与样式
@@ -105,33 +124,25 @@ st.markdown("""
     .status-dot-green { display:inline-block; width:8px; height:8px; background:#52c41a; border-radius:50%; margin-right:6px; }
     .status-dot-red { display:inline-block; width:8px; height:8px; background:#ff4d4f; border-radius:50%; margin-right:6px; }
     .status-dot-gray { display:inline-block; width:8px; height:8px; background:#d9d9d9; border-radius:50%; margin-right:6px; }
+    .wf-container { font-family: 'Menlo', 'Monaco', 'Courier New', monospace; font-size: 11px; border: 1px solid #e0e0e0; border-radius: 10px; padding: 8px 12px; background: #fafafa; }
+    .wf-row { display: flex; align-items: center; height: 18px; margin: 2px 0; }
+    .wf-row.wf-slow .wf-label { color: #d4380d; font-weight: bold; }
+    .wf-label { width: 160px; flex-shrink: 0; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; color: #666; padding-right: 8px; }
+    .wf-track { position: relative; flex-grow: 1; height: 12px; background: #f0f0f0; border-radius: 2px; }
+    .wf-bar { position: absolute; top: 0; height: 12px; min-width: 1px; border-radius: 2px; }
+    .wf-link { background: #e6f4ff; height: 12px; }
+    .wf-network { background: #4096ff; }
+    .wf-wait { background: #faad14; }
+    .wf-sleep { background: #d9d9d9; }
+    .wf-error { background: #ff4d4f; }
+    .wf-critical { outline: 2px solid #cf1322; z-index: 2; }
+    .wf-legend span { display: inline-block; width: 10px; height: 10px; border-radius: 2px; margin: 0 4px 0 10px; vertical-align: middle; }
     </style>
 """, unsafe_allow_html=True)
 
-INVALID_CHARS_REGEX = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9_\-\s]')
-
 # ==========================================
-# 2. 辅助函数
+# 2. UI 辅助函数
 # ==========================================
-def get_time_diff(start_time):
-    diff = time.time() - start_time
-    return f"{diff:.2f}s"
-
-def smart_shorten_url(text):
-    url_pattern = re.compile(r'(https?://[^\s]+)')
-    def replace_func(match):
-        url = match.group(1)
-        try:
-            domain = url.split('/')[2]
-            if "quark" in domain: domain = "夸克"
-            elif "baidu" in domain: domain = "百度"
-            suffix = url[-8:] if len(url) > 20 else url[-5:]
-            short_text = f"{domain}...{suffix}"
-            return f'<span class="smart-link" title="{url}">{short_text}</span>'
-        except:
-            return f'<span class="smart-link" title="{url}">链接...</span>'
-    return url_pattern.sub(replace_func, text)
-
 def create_copy_button_html(text_to_copy: str):
     safe_text = json.dumps(text_to_copy)[1:-1]
     return f"""
@@ -143,511 +154,457 @@ def create_copy_button_html(text_to_copy: str):
     </div>
     """
 
-def sanitize_filename(name: str) -> str:
-    if not name: return ""
-    name = re.sub(r'[【】\[\]()]', ' ', name)
-    clean_name = INVALID_CHARS_REGEX.sub('', name)
-    return re.sub(r'\s+', ' ', clean_name).strip()
-
-def extract_smart_folder_name(full_text: str, match_start: int) -> str:
-    lookback_limit = max(0, match_start - 200)
-    pre_text = full_text[lookback_limit:match_start]
-    lines = pre_text.splitlines()
-    candidate_name = ""
-    for line in reversed(lines):
-        clean_line = line.strip()
-        if not clean_line: continue
-        if re.match(r'^(百度|链接|提取码|:|：|https?|夸克|pwd|code)*$', clean_line, re.IGNORECASE):
-            continue
-        clean_line = re.sub(r'(百度|链接|提取码|:|：|pwd|夸克).*$', '', clean_line, flags=re.IGNORECASE).strip()
-        if clean_line:
-            candidate_name = clean_line
-            break
-    final_name = sanitize_filename(candidate_name)
-    if not final_name or len(final_name) < 2:
-        return f"Res_{int(time.time())}" 
-    return final_name[:50]
-
-def send_notification(bark_key, pushdeer_key, title, body):
-    if bark_key:
-        url = f"https://api.day.app/{bark_key}/{quote(title)}/{quote(body)}?icon=https://cdn-icons-png.flaticon.com/512/2991/2991110.png"
-        try: requests.get(url, timeout=5)
-        except: pass
-    if pushdeer_key:
-        url = "https://api2.pushdeer.com/message/push"
-        params = {"pushkey": pushdeer_key, "text": title, "desp": body, "type": "markdown"}
-        try: requests.get(url, params=params, timeout=5)
-        except: pass
+
+def render_waterfall_html(spans):
+    if not spans: return ""
+    span_end = max(sp['end'] for sp in spans) or 1e-6
+    critical = compute_critical_path(spans)
+    _, slowest = summarize_timeline(spans)
+    slow_links = {key[0] for key, _ in slowest}
+
+    rows = {}
+    for i, sp in enumerate(spans):
+        rows.setdefault(sp['link'], []).append(i)
+    order = sorted(rows, key=lambda link: (link is not None, link or 0))
+
+    out = ['<div class="wf-container">']
+    for link in order:
+        indices = rows[link]
+        label = "任务" if link is None else f"[{link}] {spans[indices[0]]['label']}"
+        row_class = "wf-row wf-slow" if link in slow_links else "wf-row"
+        out.append(f'<div class="{row_class}"><div class="wf-label" title="{html.escape(label)}">{html.escape(label)}</div><div class="wf-track">')
+        for i in sorted(indices, key=lambda i: spans[i]['kind'] != 'link'):
+            sp = spans[i]
+            left = sp['start'] / span_end * 100
+            width = (sp['end'] - sp['start']) / span_end * 100
+            css = "wf-error" if sp['outcome'] != 'ok' and sp['kind'] != 'link' else f"wf-{sp['kind']}"
+            if i in critical: css += " wf-critical"
+            tip = html.escape(f"{sp['provider']}:{sp['stage']} {sp['end'] - sp['start']:.2f}s ({sp['outcome']})")
+            out.append(f'<div class="wf-bar {css}" style="left:{left:.3f}%;width:{width:.3f}%" title="{tip}"></div>')
+        out.append('</div></div>')
+    out.append('<div class="wf-legend" style="margin-top:6px;color:#8c8c8c;">'
+               '<span class="wf-network"></span>网络<span class="wf-wait"></span>任务轮询'
+               '<span class="wf-sleep"></span>节流等待<span class="wf-error"></span>失败'
+               '<span class="wf-critical" style="background:#fff"></span>关键路径</div>')
+    out.append('</div>')
+    return "".join(out)
 
 # ==========================================
-# 3. 引擎类 (含百度调试增强版)
+# 3. 本地 HTTP 服务 (/metrics, /gc, /jobs)
 # ==========================================
-class QuarkEngine:
-    def __init__(self, cookies: str):
-        self.headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'cookie': cookies,
-            'origin': 'https://pan.quark.cn',
-            'referer': 'https://pan.quark.cn/',
-        }
-        self.client = httpx.AsyncClient(timeout=45.0, headers=self.headers, follow_redirects=True)
-        self.inject_cache = None
-
-    async def close(self):
-        await self.client.aclose()
-
-    def _params(self):
-        return {'pr': 'ucpro', 'fr': 'pc', '__dt': random.randint(100, 9999), '__t': int(time.time() * 1000)}
+API_MAX_BODY = 10 * 1024 * 1024  # POST /jobs 请求体上限
+API_EVENT_POLL = 0.5             # /events 推送间隔 (秒)
+
+def job_snapshot(job_id, job, since=0):
+    """任务状态 JSON；since 为已读取的日志条数，只返回新增日志"""
+    base, logs = job["log_base"], job["logs"]
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job["progress"],
+        "summary": job["summary"],
+        "logs": [{**log, "msg": html.unescape(log["msg"])} for log in logs[max(0, since - base):]],
+        "next": base + len(logs),
+    }
 
-    async def check_login(self):
+class LocalAPIHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs                  {"uid", "pin", "text"} 或 {"uid", "pin", "texts": [...]} 提交任务
+    GET  /jobs/<id>?since=N     任务状态与第 N 条之后的日志
+    GET  /jobs/<id>/events      JSON Lines 实时推送，任务结束后断开
+    GET  /jobs/<id>/result      转换后的文本或结果文件 (任务未结束返回 409；已取消的任务返回已处理的部分)
+    POST /jobs/<id>/cancel      取消运行中的任务 (已结束返回 409)
+    /jobs/<id> 下的接口都需要提交该任务的 uid 与 PIN：请求头 X-Uid / X-Pin 或查询参数 uid / pin；
+    不是该用户的任务一律按不存在处理
+    """
+    def _send(self, code, body, content_type="text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, path):
         try:
-            r = await self.client.get('https://pan.quark.cn/account/info', params=self._params())
-            data = r.json()
-            if (data.get('code') == 0 or data.get('code') == 'OK') and data.get('data'):
-                return data['data'].get('nickname', '用户')
-        except: pass
-        return None
-
-    async def get_folder_id(self, path: str):
-        parts = path.split('/')
-        curr_id = '0'
-        for part in parts:
-            if not part: continue
-            found = False
-            params = self._params()
-            params.update({'pdir_fid': curr_id, '_page': 1, '_size': 50, '_fetch_total': 'false', '_sort': 'file_type:asc,updated_at:desc'})
-            try:
-                r = await self.client.get('https://drive-pc.quark.cn/1/clouddrive/file/sort', params=params)
-                for item in r.json().get('data', {}).get('list', []):
-                    if item['file_name'] == part and item['dir']:
-                        curr_id = item['fid']
-                        found = True
-                        break
-            except: pass
-            if not found: return None 
-        return curr_id
-
-    async def process_url(self, url: str, target_fid: str, is_inject: bool = False):
-        if is_inject and self.inject_cache:
-            source_fids = self.inject_cache['fids']
-            source_tokens = self.inject_cache['tokens']
-            pwd_id = self.inject_cache['pwd_id']
-            stoken = self.inject_cache['stoken']
+            f = open(path, "rb")
+        except OSError:
+            return self._send_json(410, {"error": "结果文件已清理"})
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, 64 * 1024)
+
+    def _send_json(self, code, obj):
+        self._send(code, json.dumps(obj, ensure_ascii=False, default=str), "application/json; charset=utf-8")
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path == "/metrics":
+            self._send(200, metrics.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/gc":
+            self._send(200, json.dumps(drive_gc.get_reports(), ensure_ascii=False), "application/json; charset=utf-8")
+        elif path.startswith("/jobs/"):
+            self._get_job(path, query)
         else:
-            try:
-                if '/s/' not in url: return None, "格式错误", None
-                pwd_id = url.split('/s/')[-1].split('?')[0].split('#')[0]
-                match = re.search(r'[?&]pwd=([a-zA-Z0-9]+)', url)
-                passcode = match.group(1) if match else ""
-                
-                r = await self.client.post("https://drive-pc.quark.cn/1/clouddrive/share/sharepage/token", 
-                                         json={"pwd_id": pwd_id, "passcode": passcode}, params=self._params())
-                stoken = r.json().get('data', {}).get('stoken')
-                if not stoken: return None, "提取码失效", None
-                
-                params = self._params()
-                params.update({"pwd_id": pwd_id, "stoken": stoken, "pdir_fid": "0", "_page": 1, "_size": 50})
-                r = await self.client.get("https://drive-pc.quark.cn/1/clouddrive/share/sharepage/detail", params=params)
-                items = r.json().get('data', {}).get('list', [])
-                if not items: return None, "空分享", None
-                source_fids = [i['fid'] for i in items]
-                source_tokens = [i['share_fid_token'] for i in items]
-                first_name = items[0]['file_name']
-
-                if is_inject:
-                    self.inject_cache = {
-                        'fids': source_fids, 'tokens': source_tokens, 
-                        'pwd_id': pwd_id, 'stoken': stoken
-                    }
-            except: return None, "解析异常", None
-
+            self._send(404, "not found\n")
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            return self._cancel_job(parts[1], query)
+        if path != "/jobs":
+            return self._send(404, "not found\n")
         try:
-            save_data = {"fid_list": source_fids, "fid_token_list": source_tokens, "to_pdir_fid": target_fid, 
-                         "pwd_id": pwd_id, "stoken": stoken, "pdir_fid": "0", "scene": "link"}
-            r = await self.client.post("https://drive.quark.cn/1/clouddrive/share/sharepage/save", json=save_data, params=self._params())
-            if r.json().get('code') not in [0, 'OK']: return None, f"转存失败: {r.json().get('message')}", None
-            task_id = r.json().get('data', {}).get('task_id')
-        except: return None, "转存请求失败", None
-
-        if is_inject: return "INJECT_OK", "植入成功", None
-
-        for _ in range(8):
-            await asyncio.sleep(1)
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > API_MAX_BODY:
+                return self._send_json(413, {"error": "请求体过大"})
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            return self._send_json(400, {"error": "请求体不是合法 JSON"})
+
+        uid = str(payload.get("uid", ""))
+        user_conf, error = self._check_user(uid, payload.get("pin", ""))
+        if error: return self._send_json(*error)
+
+        texts = payload.get("texts") if isinstance(payload.get("texts"), list) else [payload.get("text", "")]
+        texts = [t for t in texts if isinstance(t, str) and t.strip()]
+        if not texts:
+            return self._send_json(400, {"error": "text 为空"})
+        job_ids = [start_job(uid, user_conf, text) for text in texts]
+        self._send_json(202, {"job_ids": job_ids} if "texts" in payload else {"job_id": job_ids[0]})
+
+    @staticmethod
+    def _check_user(uid, pin):
+        """校验 uid 与 PIN，返回 (用户配置, None) 或 (None, (状态码, 错误))"""
+        user_conf = get_configured_users().get(uid)
+        if not user_conf:
+            return None, (404, {"error": "用户不存在"})
+        stored_pin = str(user_conf.get("pin", ""))
+        if stored_pin and str(pin) != stored_pin:
+            return None, (403, {"error": "PIN 错误"})
+        return user_conf, None
+
+    def _authorized_job(self, job_id, query):
+        """取出调用方有权访问的任务；无权访问时已发送错误响应并返回 None"""
+        params = parse_qs(query)
+        uid = self.headers.get("X-Uid") or params.get("uid", [""])[0]
+        pin = self.headers.get("X-Pin") or params.get("pin", [""])[0]
+        job = job_manager.get_job(job_id)
+        if not job or not uid or job.get("owner") != uid:
+            self._send_json(404, {"error": "任务不存在或已过期"})
+            return None
+        _, error = self._check_user(uid, pin)
+        if error:
+            self._send_json(*error)
+            return None
+        return job
+
+    def _cancel_job(self, job_id, query):
+        job = self._authorized_job(job_id, query)
+        if not job: return
+        if job["status"] != "running":
+            return self._send_json(409, {"error": "任务已结束", "status": job["status"]})
+        job_manager.cancel_job(job_id)
+        self._send_json(202, {"job_id": job_id, "status": job["status"], "cancel_requested": True})
+
+    def _get_job(self, path, query):
+        parts = path.strip("/").split("/")
+        job_id, action = parts[1], (parts[2] if len(parts) > 2 else "")
+        if len(parts) > 3:
+            return self._send_json(404, {"error": "任务不存在或已过期"})
+        job = self._authorized_job(job_id, query)
+        if not job: return
+
+        if action == "":
+            since = parse_qs(query).get("since", ["0"])[0]
+            since = int(since) if since.isdigit() else 0
+            self._send_json(200, job_snapshot(job_id, job, since))
+        elif action == "result":
+            if job["status"] == "running":
+                return self._send_json(409, {"error": "任务尚未完成", "status": job["status"]})
+            if job["result_file"]:
+                self._send_file(job["result_file"])
+            else:
+                self._send(200, job["result_text"])
+        elif action == "events":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            since, last_progress = 0, None
             try:
-                params = self._params()
-                params['task_id'] = task_id
-                r = await self.client.get("https://drive-pc.quark.cn/1/clouddrive/task", params=params)
-                if r.json().get('data', {}).get('status') == 2: break
-            except: pass
-
-        await asyncio.sleep(1.5)
-        new_fid = None
-        
-        params = self._params()
-        params.update({'pdir_fid': target_fid, '_page': 1, '_size': 20, '_sort': 'updated_at:desc'})
-        try:
-            r = await self.client.get('https://drive-pc.quark.cn/1/clouddrive/file/sort', params=params)
-            for item in r.json().get('data', {}).get('list', []):
-                if item['file_name'] == first_name: 
-                    new_fid = item['fid']; break
-            if not new_fid and r.json().get('data', {}).get('list'):
-                new_fid = r.json()['data']['list'][0]['fid']
-        except: pass
-        
-        if not new_fid: return None, "✅ 已存入网盘 (但无法获取文件ID，未分享)", None
-
-        share_data = {"fid_list": [new_fid], "title": first_name, "url_type": 1, "expired_type": 1}
-        try:
-            r = await self.client.post("https://drive-pc.quark.cn/1/clouddrive/share", json=share_data, params=self._params())
-            res = r.json()
-            if res.get('code') != 0 and res.get('code') != 'OK':
-                return None, f"✅ 已存入网盘 (但分享被拦截: {res.get('message')})", None
-                
-            share_task_id = res.get('data', {}).get('task_id')
-            await asyncio.sleep(0.5)
-            params = self._params()
-            params.update({'task_id': share_task_id, 'retry_index': 0})
-            r = await self.client.get("https://drive-pc.quark.cn/1/clouddrive/task", params=params)
-            share_id = r.json().get('data', {}).get('share_id')
-            
-            r = await self.client.post("https://drive-pc.quark.cn/1/clouddrive/share/password", json={"share_id": share_id}, params=self._params())
-            return r.json()['data']['share_url'], "成功", new_fid
-        except: return None, "✅ 已存入网盘 (但分享创建异常)", None
-
-class BaiduEngine:
-    def __init__(self, cookies: str):
-        self.s = requests.Session()
-        # 调试：打印 Cookie 前10位，确认是否传入
-        print(f"\n[BaiduEngine] 初始化... Cookie长度: {len(cookies) if cookies else 0}")
-        if cookies:
-            print(f"[BaiduEngine] Cookie前缀: {cookies[:20]}...")
+                while True:
+                    snap = job_snapshot(job_id, job, since)
+                    # 只有新日志、进度变化或任务结束时才推送
+                    if snap["logs"] or snap["progress"] != last_progress or snap["status"] != "running":
+                        since, last_progress = snap["next"], snap["progress"]
+                        self.wfile.write((json.dumps(snap, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    if snap["status"] != "running": break
+                    time.sleep(API_EVENT_POLL)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
         else:
-            print("[BaiduEngine] ❌ 警告：Cookie 为空！")
+            self._send_json(404, {"error": "未知接口"})
 
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36',
-            'Referer': 'https://pan.baidu.com',
-            'Cookie': "".join(cookies.split()) if cookies else ""
-        }
-        self.bdstoken = ''
-        self.inject_cache = None
-        requests.packages.urllib3.disable_warnings()
-
-    def update_cookie_bdclnd(self, bdclnd):
-        print(f"[BaiduEngine] 更新 BDCLND: {bdclnd}")
-        current = dict(i.split('=', 1) for i in self.headers['Cookie'].split(';') if '=' in i)
-        current['BDCLND'] = bdclnd
-        self.headers['Cookie'] = ';'.join([f'{k}={v}' for k,v in current.items()])
-
-    @retry(stop_max_attempt_number=2)
-    def init_token(self):
-        url = 'https://pan.baidu.com/api/gettemplatevariable'
-        print("[BaiduEngine] 正在获取 Token...")
-        try:
-            r = self.s.get(url, params={'fields': '["bdstoken","token","uk","isdocuser"]'}, headers=self.headers, verify=False)
-            res = r.json()
-            print(f"[BaiduEngine] Token 响应: {str(res)[:100]}...")
-            if res.get('errno') == 0:
-                self.bdstoken = res['result']['bdstoken']
-                print(f"[BaiduEngine] ✅ 获取 Token 成功: {self.bdstoken}")
-                return True
-            print(f"[BaiduEngine] ❌ 获取 Token 失败: errno={res.get('errno')}")
-            return False
-        except Exception as e:
-            print(f"[BaiduEngine] ❌ init_token 异常: {e}")
-            return False
-
-    def check_dir_exists(self, path):
-        if not path.startswith("/"): path = "/" + path
-        try:
-            r = self.s.get('https://pan.baidu.com/api/list', params={'dir': path, 'bdstoken': self.bdstoken, 'start': 0, 'limit': 1}, headers=self.headers, verify=False)
-            exists = r.json().get('errno') == 0
-            print(f"[BaiduEngine] 检查目录 [{path}] 存在: {exists}")
-            return exists
-        except: return False
-
-    def create_dir(self, path):
-        if not path.startswith("/"): path = "/" + path
-        print(f"[BaiduEngine] 尝试创建目录: {path}")
-        try:
-            res = self.s.post('https://pan.baidu.com/api/create', params={'a': 'commit', 'bdstoken': self.bdstoken}, 
-                        data={'path': path, 'isdir': 1, 'block_list': '[]'}, headers=self.headers, verify=False)
-            print(f"[BaiduEngine] 创建目录响应: {res.json()}")
-        except Exception as e: 
-            print(f"[BaiduEngine] 创建目录异常: {e}")
-
-    def process_url(self, url_info: dict, root_path: str, is_inject: bool = False):
-        print(f"\n--- [BaiduEngine] 开始处理 URL: {url_info.get('url')} ---")
-        
-        if is_inject and self.inject_cache:
-            shareid = self.inject_cache['shareid']
-            uk = self.inject_cache['uk']
-            fs_id_list_str = self.inject_cache['fsidlist'] 
-            print("[BaiduEngine] 使用缓存数据植入")
-        else:
-            try:
-                url = url_info['url']
-                pwd = url_info['pwd']
-                clean_url = url.split('?')[0]
-                folder_name = url_info.get('name', 'Temp')
-
-                if pwd:
-                    surl = re.search(r'(?:surl=|/s/1|/s/)([\w\-]+)', clean_url)
-                    if not surl: return None, "URL格式错误", None
-                    print(f"[BaiduEngine] 验证提取码: {pwd} surl: {surl.group(1)}")
-                    r = self.s.post('https://pan.baidu.com/share/verify', 
-                                    params={'surl': surl.group(1), 't': int(time.time()*1000), 'bdstoken': self.bdstoken, 'channel': 'chunlei', 'web': 1, 'clienttype': 0},
-                                    data={'pwd': pwd, 'vcode': '', 'vcode_str': ''}, headers=self.headers, verify=False)
-                    print(f"[BaiduEngine] 验证结果: {r.text}")
-                    if r.json()['errno'] == 0:
-                        self.update_cookie_bdclnd(r.json()['randsk'])
-                    else:
-                        return None, f"提取码错误(errno={r.json().get('errno')})", None
+    def log_message(self, format, *args):
+        pass
 
-                print("[BaiduEngine] 请求页面内容...")
-                content = self.s.get(clean_url, headers=self.headers, verify=False).text
-                
-                if "验证码" in content or "verify" in content:
-                    print("[BaiduEngine] ❌ 警告：页面包含验证码关键字！IP可能被拦截。")
+@st.cache_resource
+def start_local_api():
+    host = get_secret("general", "api_host", "127.0.0.1")
+    port = int(get_secret("general", "api_port", 8502) or 0)
+    if not port: return None
+    try:
+        server = ThreadingHTTPServer((host, port), LocalAPIHandler)
+    except OSError as e:
+        print(f"[LocalAPI] 端口 {host}:{port} 启动失败: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[LocalAPI] 已启动: http://{host}:{port}/metrics")
+    return server
 
+# ==========================================
+# 4. 后台维护：网盘转存目录清理
+# ==========================================
+@st.cache_resource
+class DriveGC:
+    """
+    按账号定期清理 QUARK_SAVE_PATH / BAIDU_SAVE_PATH 下超过保留期、且已不再被有效分享引用的转存副本 (批量删除)。
+    仍有未过期分享的副本一律保留 (引擎创建的分享是永久的)；读取分享记录失败时本轮不删除。
+    保留期 general.gc_retention_days 未配置或为 0 时不启动。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reports = {}  # "uid/provider" -> 最近一次清理报告
+        self.thread = None
+
+    def start(self):
+        retention_days = float(get_secret("general", "gc_retention_days", 0) or 0)
+        if retention_days <= 0 or self.thread: return
+        interval = float(get_secret("general", "gc_interval_hours", 24) or 24) * 3600
+        self.thread = threading.Thread(target=self._loop, args=(retention_days, interval), daemon=True)
+        self.thread.start()
+
+    def get_reports(self):
+        with self.lock:
+            return dict(self.reports)
+
+    def _loop(self, retention_days, interval):
+        while True:
+            for uid, conf in get_configured_users().items():
                 try:
-                    shareid = re.search(r'"shareid":(\d+?),', content).group(1)
-                    uk = re.search(r'"share_uk":"(\d+?)",', content).group(1)
-                    fs_id_list = re.findall(r'"fs_id":(\d+?),', content)
-                    print(f"[BaiduEngine] 解析成功: shareid={shareid}, uk={uk}, 文件数={len(fs_id_list)}")
-                    
-                    if not fs_id_list: return None, "解析成功但无文件", None
-                    fs_id_list_str = f"[{','.join(fs_id_list)}]"
-                    
-                    if is_inject:
-                        self.inject_cache = {
-                            'shareid': shareid, 'uk': uk, 'fsidlist': fs_id_list_str
-                        }
+                    self.run_account(uid, conf, retention_days)
+                except Exception as e:
+                    print(f"[DriveGC] {uid} 清理异常: {e}")
+            time.sleep(interval)
+
+    def run_account(self, uid, conf, retention_days):
+        cutoff = time.time() - retention_days * 86400
+        for cookie, label in account_labels(uid, split_cookies(conf.get("q"))).items():
+            self._record(label, "quark", asyncio.run(self._collect_quark(label, cookie, cutoff)))
+        for cookie, label in account_labels(uid, split_cookies(conf.get("b"))).items():
+            self._record(label, "baidu", self._collect_baidu(label, cookie, cutoff))
+
+    def _record(self, uid, provider, report):
+        report["finished_at"] = (datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.reports[f"{uid}/{provider}"] = report
+        if "error" in report:
+            print(f"[DriveGC] {uid}/{provider}: {report['error']}")
+        else:
+            print(f"[DriveGC] {uid}/{provider}: 删除 {report['deleted']}/{report['expired']} 条 (共 {report['scanned']} 条，"
+                  f"仍在分享 {report['shared']} 条)，释放 {format_size(report['freed_bytes'])}")
 
-                except Exception as e: 
-                    print(f"[BaiduEngine] ❌ 正则解析失败。页面内容摘要: {content[:200]}")
-                    return None, "页面解析失败(可能IP被拦截)", None
-            except Exception as e: return None, f"异常: {str(e)[:20]}", None
+    @staticmethod
+    def _build_report(items, expired, shared, deleted, used_before, used_after, size_key):
+        listed = sum(int(i.get(size_key) or 0) for i in expired)
+        freed = used_before - used_after if used_before is not None and used_after is not None and used_before >= used_after else listed
+        return {"scanned": len(items), "expired": len(expired), "shared": shared, "deleted": deleted, "freed_bytes": freed}
 
+    async def _collect_quark(self, uid, cookie, cutoff):
+        engine = QuarkEngine(cookie, uid)
         try:
-            if is_inject:
-                save_path = root_path
-            else:
-                safe_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=4))
-                final_folder = f"{folder_name}_{safe_suffix}"
-                save_path = f"{root_path}/{final_folder}"
-                self.create_dir(save_path) 
-
-            print(f"[BaiduEngine] 开始转存至: {save_path}")
-            try:
-                r = self.s.post('https://pan.baidu.com/share/transfer', 
-                                params={'shareid': shareid, 'from': uk, 'bdstoken': self.bdstoken},
-                                data={'fsidlist': fs_id_list_str, 'path': save_path}, 
-                                headers=self.headers, verify=False, timeout=20)
-                res = r.json()
-                print(f"[BaiduEngine] 转存响应: {res}")
-            except requests.exceptions.RequestException as e:
-                print(f"[BaiduEngine] 转存请求超时: {e}")
-                return None, "转存请求超时(文件可能过大)", None
-
-            if res.get('errno') == 12: 
-                 if is_inject: return "INJECT_OK", "文件已存在", save_path
-                 return None, "转存失败(文件已存在)", None
-            
-            if res.get('errno') != 0: 
-                errno = res.get('errno')
-                err_msg = f"转存失败({errno})"
-                if errno == -10: err_msg = "容量不足或文件数超限"
-                elif errno == -33: err_msg = "文件数超出限制(非会员500)"
-                elif errno == -6: err_msg = "Cookie身份失效(-6)"
-                elif errno == 4: err_msg = "文件路径无效或包含违规内容(errno:4)"
-                print(f"[BaiduEngine] ❌ 错误详情: {err_msg}")
-                return None, err_msg, None
-
-            if is_inject: return "INJECT_OK", "成功", save_path
-
-            print("[BaiduEngine] 获取已转存文件ID用于分享...")
-            r = self.s.get('https://pan.baidu.com/api/list', params={'dir': root_path, 'bdstoken': self.bdstoken}, headers=self.headers, verify=False)
-            target_fsid = None
-            for item in r.json().get('list', []):
-                if item['server_filename'] == final_folder:
-                    target_fsid = item['fs_id']; break
-            
-            if not target_fsid: 
-                print("[BaiduEngine] ❌ 未在目录下找到刚转存的文件")
-                return None, "✅ 已存入网盘 (获取目录失败)", None
-
-            new_pwd = ''.join(random.choices(string.ascii_letters + string.digits, k=4))
-            print("[BaiduEngine] 创建分享链接...")
-            r = self.s.post('https://pan.baidu.com/share/set', 
-                            params={'bdstoken': self.bdstoken, 'channel': 'chunlei', 'clienttype': 0, 'web': 1},
-                            data={'period': 0, 'pwd': new_pwd, 'fid_list': f'[{target_fsid}]', 'schannel': 4}, headers=self.headers, verify=False)
-            print(f"[BaiduEngine] 分享响应: {r.text}")
-            
-            if r.json()['errno'] == 0:
-                return f"{r.json()['link']}?pwd={new_pwd}", "成功", save_path 
-            return None, "✅ 已存入网盘 (分享失败)", None
-
-        except Exception as e:
-            print(f"[BaiduEngine] ❌ 最终异常: {e}")
-            return None, f"发生异常: {str(e)[:20]}...", None
+            with stage_span("quark", uid, "gc") as span:
+                root_fid = await engine.get_folder_id(QUARK_SAVE_PATH)
+                if not root_fid:
+                    span.fail()
+                    return {"error": "目录不存在"}
+                shared_fids = await engine.list_shared_fids()
+                if shared_fids is None:
+                    span.fail()
+                    return {"error": "读取分享记录失败"}
+                used_before = await engine.get_used_capacity()
+                items = await engine.list_dir(root_fid)
+                # 时间戳为毫秒；缺失时间戳的条目不删除
+                old = [i for i in items if 0 < (i.get('created_at') or i.get('updated_at') or 0) / 1000 < cutoff]
+                expired = [i for i in old if i['fid'] not in shared_fids]
+                deleted = await engine.delete_files([i['fid'] for i in expired]) if expired else 0
+                used_after = await engine.get_used_capacity() if deleted else used_before
+                return self._build_report(items, expired, len(old) - len(expired), deleted, used_before, used_after, 'size')
+        finally:
+            await engine.close()
+
+    def _collect_baidu(self, uid, cookie, cutoff):
+        engine = BaiduEngine(cookie, uid)
+        with stage_span("baidu", uid, "gc") as span:
+            if not engine.init_token():
+                span.fail()
+                return {"error": "登录失败"}
+            shared_ids = engine.list_shared_fs_ids()
+            if shared_ids is None:
+                span.fail()
+                return {"error": "读取分享记录失败"}
+            used_before = engine.get_used_capacity()
+            items = engine.list_dir(BAIDU_SAVE_PATH)
+            old = [i for i in items if 0 < (i.get('server_ctime') or i.get('server_mtime') or 0) < cutoff]
+            expired = [i for i in old if str(i.get('fs_id')) not in shared_ids]
+            deleted = engine.delete_paths([i['path'] for i in expired]) if expired else 0
+            used_after = engine.get_used_capacity() if deleted else used_before
+            return self._build_report(items, expired, len(old) - len(expired), deleted, used_before, used_after, 'size')
+
+drive_gc = DriveGC()
 
 # ==========================================
-# 4. 常量定义
+# 4.1 后台维护：Cookie 健康检测
 # ==========================================
-QUARK_SAVE_PATH = "来自：分享/LinkChanger"
-BAIDU_SAVE_PATH = "/我的资源/LinkChanger"
+@st.cache_resource
+class CookieHealthMonitor:
+    """
+    后台线程按 general.health_interval 秒 (默认 300) 并发检测所有已配置账号的 Cookie，
+    结果写入共享内存表；页面渲染只查表，不再同步请求网盘。
+    未见过的 Cookie 会被插队检测，检测完成前状态为 None。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = {}      # (provider, cookie_key) -> {"ok": bool, "checked_at": ts}
+        self.pending = {}     # (provider, cookie_key) -> cookie
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.interval = 300
+
+    def start(self):
+        if self.thread: return
+        self.interval = float(get_secret("general", "health_interval", 300) or 300)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def get(self, provider, cookie):
+        """True / False / None(尚未检测)"""
+        if not cookie: return False
+        key = (provider, cookie_key(cookie))
+        with self.lock:
+            entry = self.status.get(key)
+            stale = entry is None or time.time() - entry["checked_at"] > self.interval * 2
+            if stale and key not in self.pending:
+                self.pending[key] = cookie
+                self.wakeup.set()
+        return entry["ok"] if entry else None
+
+    def get_any(self, provider, cookies):
+        """多账号汇总：任一有效为 True，全部失效为 False，否则 None"""
+        states = [self.get(provider, c) for c in split_cookies(cookies)]
+        if any(states): return True
+        if states and all(s is False for s in states): return False
+        return None if states else False
+
+    def lookup(self, q_c, b_c):
+        return {"quark": self.get_any("quark", q_c), "baidu": self.get_any("baidu", b_c)}
+
+    def _configured_targets(self):
+        targets = {}
+        for conf in get_configured_users().values():
+            for c in split_cookies(conf.get("q")): targets[("quark", cookie_key(c))] = c
+            for c in split_cookies(conf.get("b")): targets[("baidu", cookie_key(c))] = c
+        return targets
+
+    def _loop(self):
+        next_full = 0
+        while True:
+            with self.lock:
+                targets = dict(self.pending)
+                self.pending.clear()
+            if time.time() >= next_full:
+                targets.update(self._configured_targets())
+                next_full = time.time() + self.interval
+            if targets:
+                try:
+                    asyncio.run(self._check_many(targets))
+                except Exception as e:
+                    print(f"[CookieHealth] 检测异常: {e}")
+            self.wakeup.wait(max(0, next_full - time.time()))
+            self.wakeup.clear()
+
+    async def _check_many(self, targets):
+        sem = asyncio.Semaphore(HEALTH_CHECK_CONCURRENCY)
+        async def check(key, cookie):
+            async with sem:
+                try:
+                    ok = await (self._check_quark(cookie) if key[0] == "quark" else asyncio.to_thread(self._check_baidu, cookie))
+                except Exception:
+                    ok = False
+            with self.lock:
+                self.status[key] = {"ok": bool(ok), "checked_at": time.time()}
+        await asyncio.gather(*(check(key, cookie) for key, cookie in targets.items()))
+
+    @staticmethod
+    async def _check_quark(cookie):
+        engine = QuarkEngine(cookie)
+        try:
+            return await engine.check_login() is not None
+        finally:
+            await engine.close()
 
-# ==========================================
-# 5. 核心：后台线程 Worker
-# ==========================================
-def worker_thread(job_id, input_text, quark_cookie, baidu_cookie, bark_key, pushdeer_key, image_config):
-    
-    async def async_worker():
-        start_time = datetime.now()
-        final_text = input_text
-        success_count = 0
-        current_idx = 0
-        
-        quark_regex = re.compile(r'(https://pan\.quark\.cn/s/[a-zA-Z0-9]+(?:\?pwd=[a-zA-Z0-9]+)?)')
-        baidu_regex = re.compile(r'(https?://pan\.baidu\.com/s/[a-zA-Z0-9_\-]+(?:\?pwd=[a-zA-Z0-9]+)?)')
-        q_matches = list(quark_regex.finditer(input_text))
-        b_matches = list(baidu_regex.finditer(input_text))
-        total_tasks = len(q_matches) + len(b_matches)
-        
-        job_manager.update_progress(job_id, 0, total_tasks)
-        
-        q_engine = QuarkEngine(quark_cookie) if q_matches else None
-        b_engine = BaiduEngine(baidu_cookie) if b_matches else None
+    @staticmethod
+    def _check_baidu(cookie):
+        return BaiduEngine(cookie).init_token()
 
-        try:
-            # --- 夸克 ---
-            if q_matches:
-                if not quark_cookie: 
-                    job_manager.add_log(job_id, "夸克：未配置Cookie，跳过", "error")
-                else:
-                    job_manager.add_log(job_id, "开始处理夸克链接...", "quark")
-                    t0 = time.time()
-                    user = await q_engine.check_login()
-                    if not user: 
-                        job_manager.add_log(job_id, f"登录失败 (耗时: {get_time_diff(t0)})", "error")
-                    else:
-                        job_manager.add_log(job_id, f"登录成功: {user} (耗时: {get_time_diff(t0)})", "success")
-                        t_root = time.time()
-                        root_fid = await q_engine.get_folder_id(QUARK_SAVE_PATH)
-                        if not root_fid: 
-                            job_manager.add_log(job_id, f"目录不存在，手动在夸克网盘中创建 来自：分享/LinkChanger文件夹 (耗时: {get_time_diff(t_root)})", "error")
-                        else:
-                            for match in q_matches:
-                                current_idx += 1
-                                raw_url = match.group(1)
-                                step_prefix = f"[{current_idx}/{total_tasks}]"
-                                
-                                job_manager.add_log(job_id, f"{step_prefix} 处理中: {raw_url}", "quark")
-                                job_manager.update_progress(job_id, current_idx, total_tasks)
-                                
-                                t_task = time.time()
-                                new_url, msg, new_fid = await q_engine.process_url(raw_url, root_fid)
-                                t_task_end = get_time_diff(t_task)
-                                
-                                if new_url:
-                                    log_msg = f"{step_prefix} 转存成功: {new_url} (耗时: {t_task_end})"
-                                    if image_config['quark']['enabled'] and new_fid:
-                                        t_img = time.time()
-                                        res_url, res_msg, _ = await q_engine.process_url(image_config['quark']['url'], new_fid, is_inject=True)
-                                        if res_url == "INJECT_OK": log_msg += f" + 植入(耗时:{get_time_diff(t_img)})"
-                                    
-                                    job_manager.add_log(job_id, log_msg, "success")
-                                    final_text = final_text.replace(raw_url, new_url)
-                                    success_count += 1
-                                else:
-                                    job_manager.add_log(job_id, f"{step_prefix} {msg} (耗时: {t_task_end})", "error")
-
-                                await asyncio.sleep(random.uniform(2, 4))
-
-            # --- 百度 ---
-            if b_matches:
-                if not baidu_cookie: 
-                    job_manager.add_log(job_id, "百度：未配置Cookie，跳过", "error")
-                else:
-                    job_manager.add_log(job_id, "开始处理百度链接...", "baidu")
-                    t0 = time.time()
-                    if not b_engine.init_token(): 
-                        job_manager.add_log(job_id, f"登录失败 (耗时: {get_time_diff(t0)})", "error")
-                    else:
-                        job_manager.add_log(job_id, f"登录成功 (耗时: {get_time_diff(t0)})", "success")
-                        if not b_engine.check_dir_exists(BAIDU_SAVE_PATH): b_engine.create_dir(BAIDU_SAVE_PATH)
-                        
-                        for match in b_matches:
-                            current_idx += 1
-                            raw_url = match.group(1)
-                            pwd_match = re.search(r'(?:\?pwd=|&pwd=|\s+|提取码[:：]?\s*)([a-zA-Z0-9]{4})', match.group(0))
-                            pwd = pwd_match.group(1) if pwd_match else ""
-                            step_prefix = f"[{current_idx}/{total_tasks}]"
-                            
-                            job_manager.add_log(job_id, f"{step_prefix} 处理中: {raw_url}", "baidu")
-                            job_manager.update_progress(job_id, current_idx, total_tasks)
-                            
-                            t_task = time.time()
-                            name = extract_smart_folder_name(input_text, match.start())
-                            new_url, msg, new_dir_path = b_engine.process_url({'url': raw_url, 'pwd': pwd, 'name': name}, BAIDU_SAVE_PATH)
-                            t_task_end = get_time_diff(t_task)
-                            
-                            if new_url:
-                                log_msg = f"{step_prefix} 转存成功: {new_url} (耗时: {t_task_end})"
-                                if image_config['baidu']['enabled'] and new_dir_path:
-                                    t_img = time.time()
-                                    img_res_url, img_msg, _ = b_engine.process_url({'url': image_config['baidu']['url'], 'pwd': image_config['baidu']['pwd']}, new_dir_path, is_inject=True)
-                                    if img_res_url == "INJECT_OK": log_msg += f" + 植入(耗时:{get_time_diff(t_img)})"
-
-                                job_manager.add_log(job_id, log_msg, "success")
-                                final_text = final_text.replace(raw_url, new_url)
-                                success_count += 1
-                            else:
-                                job_manager.add_log(job_id, f"{step_prefix} {msg} (耗时: {t_task_end})", "error")
-
-                            time.sleep(random.uniform(2, 4))
+cookie_health = CookieHealthMonitor()
 
-        finally:
-            if q_engine: await q_engine.close()
-            duration_obj = datetime.now() - start_time
-            duration_str = str(duration_obj)[:-4] if len(str(duration_obj)) > 4 else str(duration_obj)
-            summary = {"success": success_count, "total": total_tasks, "duration": str(duration_obj)}
-            job_manager.complete_job(job_id, final_text, summary)
-            
-            if bark_key or pushdeer_key:
-                body_msg = f"成功: {success_count}/{total_tasks} | 耗时: {duration_str}"
-                title_msg = "✅ 转存完成" if success_count > 0 else "❌ 转存结束(无成功)"
-                send_notification(bark_key, pushdeer_key, title_msg, body_msg)
+# ==========================================
+# 4.2 后台维护：账号登录态预热
+# ==========================================
+@st.cache_resource
+class SessionWarmer:
+    """
+    general.warmup 开启时，启动后立即为所有已配置账号登录并定位保存目录 (写入 account_sessions)，
+    之后每 general.warmup_interval 秒 (默认为登录态有效期的一半) 补齐过期的账号，
+    空闲一段时间后的第一个任务同样不用在关键路径上登录。
+    """
+    def __init__(self):
+        self.thread = None
+
+    def start(self):
+        if self.thread or str(get_secret("general", "warmup", "")).lower() not in ("1", "true", "yes", "on"): return
+        interval = float(get_secret("general", "warmup_interval", ACCOUNT_SESSION_TTL / 2) or ACCOUNT_SESSION_TTL / 2)
+        self.thread = threading.Thread(target=self._loop, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def _loop(self, interval):
+        while True:
+            t0 = time.time()
+            for uid, conf in get_configured_users().items():
+                try:
+                    asyncio.run(warm_accounts(split_cookies(conf.get("q")), split_cookies(conf.get("b")), uid))
+                except Exception as e:
+                    print(f"[Warmup] {uid} 预热异常: {e}")
+            print(f"[Warmup] 账号预热完成 (耗时: {time.time() - t0:.1f}s)")
+            time.sleep(interval)
 
-    asyncio.run(async_worker())
+session_warmer = SessionWarmer()
 
 # ==========================================
-# 6. 主逻辑 (前端 UI + 多用户认证)
+# 5. 主逻辑 (前端 UI + 多用户认证)
 # ==========================================
 
 # Cookie 管理器初始化 - 已移除 @st.cache_resource 装饰器
 def get_manager():
     return stx.CookieManager()
 
-@st.cache_data(ttl=300) 
-def check_cookies_validity(q_c, b_c):
-    status = {"quark": False, "baidu": False}
-    if q_c:
-        try:
-            headers = { 'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36', 'cookie': q_c, 'referer': 'https://pan.quark.cn/' }
-            params = {'pr': 'ucpro', 'fr': 'pc', '__dt': random.randint(100, 9999)}
-            r = requests.get('https://pan.quark.cn/account/info', headers=headers, params=params, timeout=5)
-            data = r.json()
-            if (data.get('code') == 0 or data.get('code') == 'OK') and data.get('data'): status["quark"] = True
-        except: pass
-    if b_c:
-        try:
-            b_eng = BaiduEngine(b_c)
-            if b_eng.init_token(): status["baidu"] = True
-        except: pass
-    return status
-
 def auth_user():
     """多用户认证流程"""
     cookie_manager = get_manager()
@@ -694,6 +651,14 @@ def auth_user():
     st.stop() # 阻止后续代码执行，直到验证通过
 
 def main():
+    start_local_api()
+    drive_gc.start()
+    cookie_health.start()
+    session_warmer.start()
+    # 发件箱不保存通知 key，重启后按 uid 从 secrets 重新查找
+    notifier.key_resolver = lambda uid: get_configured_users().get(uid)
+    notifier.start()
+
     # 1. 进行身份验证，获取当前用户的配置
     uid, user_conf = auth_user()
     
@@ -702,42 +667,34 @@ def main():
     
     bark_key = user_conf.get("bark", "")
     pushdeer_key = user_conf.get("pushdeer", "")
-    q_c = user_conf.get("q", "")
-    b_c = user_conf.get("b", "")
+    q_c = split_cookies(user_conf.get("q", ""))
+    b_c = split_cookies(user_conf.get("b", ""))
     
     # 构建当前用户的图片配置
-    q_img_url = user_conf.get("q_img", "")
-    b_img_url = user_conf.get("b_img", "")
-    
-    current_image_config = {
-        "quark": {
-            "url": q_img_url,
-            "enabled": bool(q_img_url and q_img_url.strip())
-        },
-        "baidu": {
-            "url": b_img_url,
-            "pwd": user_conf.get("b_pwd", ""),
-            "name": "公众号关注.jpg",
-            "enabled": bool(b_img_url and b_img_url.strip())
-        }
-    }
+    current_image_config = build_image_config(user_conf)
 
     # 🟡 自动检测 Cookie 有效性
-    cookie_status = check_cookies_validity(q_c, b_c)
+    cookie_status = cookie_health.lookup(q_c, b_c)
+    q_note = f" ({len(q_c)} 个账号)" if len(q_c) > 1 else ""
+    b_note = f" ({len(b_c)} 个账号)" if len(b_c) > 1 else ""
 
     with st.sidebar:
         st.header("⚙️ 状态监控")
         if not q_c:
             st.markdown('<span class="status-dot-gray"></span> 夸克: 未配置', unsafe_allow_html=True)
         elif cookie_status["quark"]:
-            st.markdown('<span class="status-dot-green"></span> 夸克: <span style="color:#52c41a">有效</span>', unsafe_allow_html=True)
+            st.markdown(f'<span class="status-dot-green"></span> 夸克: <span style="color:#52c41a">有效</span>{q_note}', unsafe_allow_html=True)
+        elif cookie_status["quark"] is None:
+            st.markdown('<span class="status-dot-gray"></span> 夸克: 检测中...', unsafe_allow_html=True)
         else:
             st.markdown('<span class="status-dot-red"></span> 夸克: <span style="color:#ff4d4f">已失效</span>', unsafe_allow_html=True)
             
         if not b_c:
             st.markdown('<span class="status-dot-gray"></span> 百度: 未配置', unsafe_allow_html=True)
         elif cookie_status["baidu"]:
-            st.markdown('<span class="status-dot-green"></span> 百度: <span style="color:#52c41a">有效</span>', unsafe_allow_html=True)
+            st.markdown(f'<span class="status-dot-green"></span> 百度: <span style="color:#52c41a">有效</span>{b_note}', unsafe_allow_html=True)
+        elif cookie_status["baidu"] is None:
+            st.markdown('<span class="status-dot-gray"></span> 百度: 检测中...', unsafe_allow_html=True)
         else:
             st.markdown('<span class="status-dot-red"></span> 百度: <span style="color:#ff4d4f">已失效</span>', unsafe_allow_html=True)
 
@@ -760,20 +717,30 @@ def main():
 
     if not current_job_id:
         st.info("💡 提示：夸克/百度后台自动运行，任务开始后可切换网页或软件后台。")
-        input_text = st.text_area("📝 粘贴链接...", height=150, key="link_input")
-        
-        if st.button("🚀 开始转存", type="primary", use_container_width=True):
-            if not input_text.strip():
+        tab_text, tab_file = st.tabs(["📝 粘贴文本", "📁 批量文件"])
+
+        with tab_text:
+            input_text = st.text_area("📝 粘贴链接...", height=150, key="link_input",
+                                      on_change=prefetch_input, args=(uid, user_conf),
+                                      help="粘贴后点击空白处或按 Ctrl+Enter，会在后台提前解析链接")
+            start_text = st.button("🚀 开始转存", type="primary", use_container_width=True)
+        with tab_file:
+            st.caption("支持 .txt (空行分隔帖子) / .csv / .jsonl，逐条处理并写入结果文件，适合大批量。")
+            upload = st.file_uploader("上传文件", type=list(BULK_FORMATS), key="bulk_upload")
+            start_file = st.button("🚀 开始处理文件", type="primary", use_container_width=True, disabled=upload is None)
+
+        if start_text or start_file:
+            if start_text and not input_text.strip():
                 st.toast("请输入内容", icon="⚠️"); return
             
-            if not cookie_status["quark"] and not cookie_status["baidu"]:
+            if cookie_status["quark"] is False and cookie_status["baidu"] is False:
                  st.error("❌ 所有账号 Cookie 均已失效，请更新 Secrets 后重试。")
                  return
 
-            new_job_id = job_manager.create_job()
-            
-            t = threading.Thread(target=worker_thread, args=(new_job_id, input_text, q_c, b_c, bark_key, pushdeer_key, current_image_config))
-            t.start()
+            if start_file:
+                new_job_id = start_bulk_job(uid, user_conf, upload, upload.name)
+            else:
+                new_job_id = start_job(uid, user_conf, input_text)
             
             st.query_params["job_id"] = new_job_id
             st.rerun()
@@ -791,12 +758,22 @@ def main():
             if status == "running":
                 st.markdown(f"### 🔄 运行中... <span class='running-badge'>RUNNING</span>", unsafe_allow_html=True)
                 st.caption(f"ID: `{current_job_id}`")
+                if job_data['cancel_requested']:
+                    st.button("⏳ 正在取消...", disabled=True, use_container_width=True)
+                elif st.button("⏹ 取消任务", use_container_width=True):
+                    job_manager.cancel_job(current_job_id)
+                    st.rerun()
+            elif status == "cancelled":
+                st.markdown("### ⏹ 已取消")
             else:
                 st.markdown("### ✅ 已完成")
 
             prog = job_data['progress']
             if prog['total'] > 0:
-                st.progress(prog['current'] / prog['total'], text=f"进度: {prog['current']} / {prog['total']}")
+                if job_data['bulk']:
+                    st.progress(min(prog['current'] / prog['total'], 1.0), text=f"进度: {format_size(prog['current'])} / {format_size(prog['total'])}")
+                else:
+                    st.progress(prog['current'] / prog['total'], text=f"进度: {prog['current']} / {prog['total']}")
 
             with st.expander("📜 执行日志", expanded=True):
                 st.markdown('<div class="log-container">', unsafe_allow_html=True)
@@ -820,7 +797,16 @@ def main():
                     """, unsafe_allow_html=True)
                 st.markdown('</div>', unsafe_allow_html=True)
 
-            if status == "done":
+            timeline = list(job_data.get('timeline') or [])
+            if timeline:
+                with st.expander("⏱ 时间线 (瀑布图)", expanded=False):
+                    totals, slowest = summarize_timeline(timeline)
+                    st.caption(f"网络: {totals['network']:.1f}s | 任务轮询: {totals['wait']:.1f}s | 节流等待: {totals['sleep']:.1f}s")
+                    if slowest:
+                        st.caption("最慢链接: " + "，".join(f"[{key[0]}] {dur:.1f}s" for key, dur in slowest))
+                    st.markdown(render_waterfall_html(timeline), unsafe_allow_html=True)
+
+            if status != "running":
                 res_text = job_data['result_text']
                 summary = job_data['summary']
                 duration_str = str(summary.get('duration', '0s'))
@@ -829,7 +815,7 @@ def main():
                 st.markdown(f"""
                 <div class="result-box">
                     <p style="margin:0;color:#389e0d;font-weight:bold;font-size:16px;">
-                        🎉 处理完成
+                        {"⏹ 已取消 (已转换的链接已写入结果，其余保持原样)" if status == "cancelled" else "🎉 处理完成"}
                     </p>
                     <p style="margin-top:8px;color:#666;font-size:14px;">
                         成功: <b style="color:#52c41a">{summary.get('success', 0)}</b> / {summary.get('total', 0)} 
@@ -838,8 +824,16 @@ def main():
                 </div>
                 """, unsafe_allow_html=True)
                 
-                st.text_area("⬇️ 最终结果 (可直接复制)", value=res_text, height=200)
-                components.html(create_copy_button_html(res_text), height=80)
+                if job_data['result_file']:
+                    if os.path.exists(job_data['result_file']):
+                        with open(job_data['result_file'], "rb") as f:
+                            st.download_button("⬇️ 下载结果文件", data=f, file_name=os.path.basename(job_data['result_file']),
+                                               use_container_width=True)
+                    else:
+                        st.warning("结果文件已清理")
+                else:
+                    st.text_area("⬇️ 最终结果 (可直接复制)", value=res_text, height=200)
+                    components.html(create_copy_button_html(res_text), height=80)
                 
                 if st.button("🗑️ 开始新任务", use_container_width=True):
                     st.query_params.clear()
@@ -0,0 +1,183 @@
+import re
+import time
+
+import pytest
+
+import linkcore
+from linkcore import (
+    DeadLinkCache, FolderNameIndex, TTLCache, classify_account_error, classify_dead_link, compute_critical_path,
+    iter_share_links, sanitize_filename, scan_share_links, split_cookies
+)
+
+# ==========================================
+# 链接识别
+# ==========================================
+def test_scan_mixed_providers_in_order():
+    text = ("电影A https://pan.quark.cn/s/abc123\n"
+            "电影B https://pan.baidu.com/s/1Xy_z-9 提取码: k3j9\n"
+            "电影C http://pan.baidu.com/s/1plain\n")
+    links = scan_share_links(text)
+    assert [(link.provider, link.url, link.pwd) for link in links] == [
+        ("quark", "https://pan.quark.cn/s/abc123", ""),
+        ("baidu", "https://pan.baidu.com/s/1Xy_z-9", "k3j9"),
+        ("baidu", "http://pan.baidu.com/s/1plain", ""),
+    ]
+    for link in links:
+        assert text[link.start:link.end] == link.url
+
+def test_scan_passcode_in_url():
+    links = scan_share_links("看 https://pan.baidu.com/s/1abc?pwd=ab12 和 https://pan.quark.cn/s/q1?pwd=QQ99 提取码: zzzz")
+    assert [link.url for link in links] == ["https://pan.baidu.com/s/1abc?pwd=ab12", "https://pan.quark.cn/s/q1?pwd=QQ99"]
+    # URL 自带的提取码优先于后面的文字
+    assert [link.pwd for link in links] == ["ab12", "QQ99"]
+
+@pytest.mark.parametrize("tail, pwd", [
+    (" 提取码：ab12", "ab12"),
+    ("\n访问码 = 9xY7", "9xY7"),
+    (" 密码:Ab3d", "Ab3d"),
+    (" PWD ab12", "ab12"),
+    (" 提取码: ab123", ""),                   # 不是 4 位
+    (" " + "说明" * 25 + " 提取码: ab12", ""),  # 超出 PASSCODE_WINDOW
+])
+def test_scan_nearby_passcode(tail, pwd):
+    links = scan_share_links("https://pan.baidu.com/s/1abc" + tail)
+    assert len(links) == 1 and links[0].pwd == pwd
+
+def test_scan_passcode_does_not_cross_next_link():
+    links = scan_share_links("https://pan.baidu.com/s/1first https://pan.baidu.com/s/1second 提取码: ab12")
+    assert [link.pwd for link in links] == ["", "ab12"]
+
+def test_iter_share_links_matches_scan_across_chunks():
+    text = "".join(f"资源{i} https://pan.baidu.com/s/1link{i} 提取码: a{i:03d}\n" for i in range(50))
+    chunks = [text[i:i + 37] for i in range(0, len(text), 37)]
+    assert list(iter_share_links(chunks)) == scan_share_links(text)
+
+# ==========================================
+# 文件夹名推导：与原先逐次回看的实现一致
+# ==========================================
+def baseline_folder_name(full_text, match_start):
+    """原 linkup.extract_smart_folder_name"""
+    lookback_limit = max(0, match_start - 200)
+    pre_text = full_text[lookback_limit:match_start]
+    lines = pre_text.splitlines()
+    candidate_name = ""
+    for line in reversed(lines):
+        clean_line = line.strip()
+        if not clean_line: continue
+        if re.match(r'^(百度|链接|提取码|:|：|https?|夸克|pwd|code)*$', clean_line, re.IGNORECASE):
+            continue
+        clean_line = re.sub(r'(百度|链接|提取码|:|：|pwd|夸克).*$', '', clean_line, flags=re.IGNORECASE).strip()
+        if clean_line:
+            candidate_name = clean_line
+            break
+    final_name = sanitize_filename(candidate_name)
+    if not final_name or len(final_name) < 2:
+        return f"Res_{int(time.time())}"
+    return final_name[:50]
+
+FOLDER_TEXTS = [
+    "【电影】流浪地球2 (2023)\n链接：https://pan.baidu.com/s/1abc 提取码：1234\n",
+    "标题一\r\n\r\n百度网盘：\r\nhttps://pan.quark.cn/s/q1\n第二部 夸克 https://pan.quark.cn/s/q2",
+    "https://pan.baidu.com/s/1nothing-before",
+    "x\n" + "很长的一行说明文字" * 30 + "\n链接: https://pan.baidu.com/s/1long",
+    "名称A https://pan.baidu.com/s/1sep\x0c名称B\x1dhttps://pan.quark.cn/s/sep2",
+    "合集/第1季:第2集 https://pan.quark.cn/s/a1 第3集 https://pan.quark.cn/s/a2 pwd: ab12",
+]
+
+@pytest.mark.parametrize("text", FOLDER_TEXTS)
+def test_folder_name_index_matches_baseline(text, monkeypatch):
+    monkeypatch.setattr(linkcore.time, "time", lambda: 1700000000.0)
+    index = FolderNameIndex(text)
+    for link in scan_share_links(text):
+        assert index.name_at(link.start) == baseline_folder_name(text, link.start)
+
+# ==========================================
+# 错误分类
+# ==========================================
+@pytest.mark.parametrize("msg, reason", [
+    ("提取码失效: 分享已取消", "expired"),
+    ("提取码错误(errno=-9)", "passcode"),
+    ("空分享", "empty"),
+    ("解析成功但无文件", "empty"),
+    ("URL格式错误", "format"),
+    ("提取码验证失败(errno=-62)", None),
+    ("分享解析失败(code=41001): 请求过于频繁", None),
+    ("页面解析失败(可能IP被拦截)", None),
+    ("", None),
+    (None, None),
+])
+def test_classify_dead_link(msg, reason):
+    assert classify_dead_link(msg) == reason
+
+@pytest.mark.parametrize("msg, kind", [
+    ("转存失败: 容量不足", "quota"),
+    ("文件数超出限制", "quota"),
+    ("Insufficient capacity", "quota"),
+    ("需要输入验证码", "throttle"),
+    ("请求过于频繁", "throttle"),
+    ("Too Many Requests", "throttle"),
+    ("提取码失效", None),
+    ("", None),
+    (None, None),
+])
+def test_classify_account_error(msg, kind):
+    assert classify_account_error(msg) == kind
+
+# ==========================================
+# 缓存与配置解析
+# ==========================================
+def test_ttl_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(linkcore.time, "time", lambda: now[0])
+    cache = TTLCache(ttl=10, max_entries=10)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    now[0] += 10
+    assert cache.get("a") is None
+    assert "a" not in cache.entries
+
+def test_ttl_cache_evicts_oldest_and_drops():
+    cache = TTLCache(ttl=60, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 3)  # 重新写入算作最新
+    cache.put("c", 4)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (3, None, 4)
+    cache.drop("a")
+    cache.drop("missing")
+    assert cache.get("a") is None
+
+def test_dead_link_cache_keeps_reason_and_skips_other_errors():
+    cache = DeadLinkCache()
+    link, = scan_share_links("https://pan.quark.cn/s/abc?pwd=ab12")
+    assert cache.put(link, "提取码失效: 分享已取消") == "expired"
+    other, = scan_share_links("https://pan.quark.cn/s/other")
+    assert cache.put(other, "请求过于频繁") is None
+    same, = scan_share_links("https://pan.quark.cn/s/abc 提取码: ab12")  # 提取码写在链接后面也命中同一条
+    assert cache.get(same) == "提取码失效: 分享已取消"
+    assert cache.get(other) is None
+
+@pytest.mark.parametrize("value, expected", [
+    ("", []),
+    (None, []),
+    ("single=1; b=2", ["single=1; b=2"]),
+    ("one=1\n\n  two=2  \r\nthree=3\n", ["one=1", "two=2", "three=3"]),
+    (["one=1", " ", "two=2 "], ["one=1", "two=2"]),
+])
+def test_split_cookies(value, expected):
+    assert split_cookies(value) == expected
+
+# ==========================================
+# 关键路径
+# ==========================================
+def span(start, end, kind="network"):
+    return {"kind": kind, "start": start, "end": end}
+
+def test_critical_path_walks_back_from_latest_end():
+    spans = [span(0, 10, "link"), span(0, 2), span(0, 3), span(6, 6), span(2, 5), span(3, 6), span(6, 9)]
+    # 6~9 → 零时长的 6~6 → 3~6 → 0~3；链接外层 span 不参与
+    assert compute_critical_path(spans) == {6, 3, 5, 2}
+
+def test_critical_path_tie_prefers_first_recorded():
+    assert compute_critical_path([span(1, 4), span(2, 4), span(0, 1)]) == {0, 2}
+    assert compute_critical_path([span(0, 5, "link")]) == set()
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from linkcore import PipelineStage, StagedPipeline, job_manager, trace_link
+
+# ==========================================
+# StagedPipeline：阶段顺序、异常传递、取消与关闭
+# ==========================================
+def run(coro):
+    return asyncio.run(coro)
+
+def test_items_pass_stages_in_order():
+    seen = []
+
+    def stage(name, last=False):
+        async def func(item):
+            await asyncio.sleep(0.01 * (item % 3))  # 打乱完成顺序
+            seen.append((item, name))
+            return f"{name}:{item}" if last else None
+        return func
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("a", stage("a"), 2),
+                                   PipelineStage("b", stage("b"), 1),
+                                   PipelineStage("c", stage("c", last=True), 3)])
+        try:
+            return await asyncio.gather(*(pipeline.submit(i) for i in range(6)))
+        finally:
+            await pipeline.close()
+
+    assert run(main()) == [f"c:{i}" for i in range(6)]
+    for i in range(6):
+        assert [name for item, name in seen if item == i] == ["a", "b", "c"]
+
+def test_non_none_result_ends_early():
+    calls = []
+
+    async def first(item):
+        return "short" if item == 0 else None
+
+    async def second(item):
+        calls.append(item)
+        return "full"
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("first", first, 1), PipelineStage("second", second, 1)])
+        try:
+            return await asyncio.gather(pipeline.submit(0), pipeline.submit(1))
+        finally:
+            await pipeline.close()
+
+    assert run(main()) == ["short", "full"]
+    assert calls == [1]
+
+def test_stage_exception_reaches_submitter_only():
+    async def flaky(item):
+        if item == "bad": raise ValueError("boom")
+        return item
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("only", flaky, 1)])
+        try:
+            results = await asyncio.gather(pipeline.submit("bad"), pipeline.submit("good"), return_exceptions=True)
+            results.append(await pipeline.submit("again"))  # 工作协程没有因异常退出
+            return results
+        finally:
+            await pipeline.close()
+
+    bad, good, again = run(main())
+    assert isinstance(bad, ValueError) and str(bad) == "boom"
+    assert (good, again) == ("good", "again")
+
+def test_cancel_before_stops_at_stage_boundary():
+    job_id = job_manager.create_job()
+    started, finished = [], []
+
+    async def begin(item):
+        started.append(item)
+        job_manager.cancel_job(job_id)  # 第一个阶段进行中请求取消
+        return None
+
+    async def commit(item):
+        finished.append(item)
+        return "done"
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("begin", begin, 1),
+                                   PipelineStage("commit", commit, 1, cancel_before=True)],
+                                  cancelled_result="cancelled")
+        trace_link(job_id, 1, "link")
+        try:
+            return await pipeline.submit("x")
+        finally:
+            await pipeline.close()
+
+    assert run(main()) == "cancelled"
+    assert started == ["x"] and finished == []
+
+def test_interval_spaces_stage_starts():
+    starts = []
+
+    async def stamp(item):
+        starts.append(asyncio.get_running_loop().time())
+        return item
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("paced", stamp, 3, interval=0.05)])
+        try:
+            await asyncio.gather(*(pipeline.submit(i) for i in range(3)))
+        finally:
+            await pipeline.close()
+
+    run(main())
+    gaps = [b - a for a, b in zip(starts, starts[1:])]
+    assert all(gap >= 0.045 for gap in gaps)
+
+def test_interval_wait_is_recorded_as_pacing():
+    job_id = job_manager.create_job()
+
+    async def noop(item):
+        return item
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("paced", noop, 2, interval=0.05)], provider="quark", account="acc")
+
+        async def submit(i):
+            trace_link(job_id, i, f"link{i}")
+            return await pipeline.submit(i)
+        try:
+            await asyncio.gather(*(submit(i) for i in range(3)))
+        finally:
+            await pipeline.close()
+
+    run(main())
+    pacing = [sp for sp in job_manager.get_job(job_id)["timeline"] if sp["stage"] == "pacing"]
+    assert sorted(sp["link"] for sp in pacing) == [1, 2]  # 第一个条目无需等待
+    assert all(sp["kind"] == "sleep" and sp["provider"] == "quark" for sp in pacing)
+
+def test_close_cancels_workers():
+    async def forever(item):
+        await asyncio.sleep(3600)
+
+    async def main():
+        pipeline = StagedPipeline([PipelineStage("a", forever, 2), PipelineStage("b", forever, 3)])
+        pending = asyncio.ensure_future(pipeline.submit("x"))
+        await asyncio.sleep(0.01)
+        workers = list(pipeline.workers)
+        assert len(workers) == 5
+        await pipeline.close()
+        pending.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        return workers, pipeline.workers
+
+    workers, remaining = run(main())
+    assert all(worker.cancelled() for worker in workers)
+    assert remaining == []